@@ -0,0 +1,100 @@
+"""Общие ресурсы процесса: один Bot со своим пулом HTTP-соединений и один engine.
+
+Ничего не создаётся при импорте: engine - при первом запросе к базе, Bot -
+при первом обращении к app.bot. Поэтому скрипты, бенчмарки и импорт модулей
+бота не открывают соединений и не тянут aiogram, если он не нужен.
+Хуки on_engine/on_bot подключают метрики и трассировку к созданному ресурсу.
+"""
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+API_TOKEN = os.getenv("TELEGRAM_API_TOKEN") or ""
+# TELEGRAM_API_SERVER - локальный Bot API сервер (или фейковый для тестов)
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")
+# Соединений с Bot API в пуле aiohttp-сессии бота
+BOT_HTTP_LIMIT = int(os.getenv("BOT_HTTP_LIMIT", "100"))
+
+
+class AppContext:
+    def __init__(self):
+        # None - DATABASE_URL; бенчмарки подставляют свою базу до первого запроса
+        self.database_url = None
+        self._engine = None
+        self._session_factory = None
+        self._bot = None
+        self._engine_hooks = []
+        self._bot_hooks = []
+
+    def _start_engine(self):
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+
+        from database import create_engine
+
+        self._engine = create_engine(self.database_url)
+        self._session_factory = async_sessionmaker(
+            self._engine, expire_on_commit=False
+        )
+        for hook in self._engine_hooks:
+            hook(self._engine)
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._start_engine()
+        return self._engine
+
+    def session(self):
+        # Короткая сессия на апдейт или задачу; соединение берётся при запросе
+        if self._engine is None:
+            self._start_engine()
+        return self._session_factory()
+
+    @property
+    def bot(self):
+        if self._bot is None:
+            from aiogram import Bot
+            from aiogram.client.session.aiohttp import AiohttpSession
+            from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+
+            api = PRODUCTION
+            if TELEGRAM_API_SERVER:
+                api = TelegramAPIServer.from_base(TELEGRAM_API_SERVER)
+            session = AiohttpSession(api=api, limit=BOT_HTTP_LIMIT)
+            self._bot = Bot(token=API_TOKEN, session=session)
+            for hook in self._bot_hooks:
+                hook(self._bot)
+        return self._bot
+
+    def on_engine(self, hook):
+        # hook(engine) вызывается один раз, когда engine создан
+        self._engine_hooks.append(hook)
+        if self._engine is not None:
+            hook(self._engine)
+
+    def on_bot(self, hook):
+        self._bot_hooks.append(hook)
+        if self._bot is not None:
+            hook(self._bot)
+
+    def pool_stat(self, name):
+        # Счётчики пула для метрик; пока engine не создан или у NullPool - None
+        if self._engine is None:
+            return None
+        method = getattr(self._engine.pool, name, None)
+        return method() if method else None
+
+    async def close(self):
+        # Закрывает созданные ресурсы; после этого их можно создать заново
+        if self._bot is not None:
+            await self._bot.session.close()
+            self._bot = None
+        if self._engine is not None:
+            await self._engine.dispose()
+            self._engine = None
+            self._session_factory = None
+
+
+app = AppContext()
@@ -0,0 +1,89 @@
+"""Выгрузка архива итогов операторов (daily_totals) в сжатый CSV.
+
+Сырые балансы хранятся BALANCE_RETENTION_DAYS дней, а итоги по операторам
+за рабочие сутки - бессрочно. Выгрузка идёт по месяцам, строки отсортированы
+по оператору и дню, поэтому gzip сжимает их до нескольких байт на
+операторо-день.
+Запуск: python archive.py 2026-09 --out archive/
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import os
+from datetime import date, datetime
+
+from sqlalchemy import select
+
+from app import app
+from database import DailyTotal, User
+
+COLUMNS = [
+    "business_day",
+    "user_id",
+    "nickname",
+    "site",
+    "admin_nickname",
+    "top_admin",
+    "total_cents",
+    "extra_cents",
+    "count",
+]
+
+
+def month_range(month):
+    first_day = datetime.strptime(month, "%Y-%m").date()
+    if first_day.month == 12:
+        return first_day, date(first_day.year + 1, 1, 1)
+    return first_day, date(first_day.year, first_day.month + 1, 1)
+
+
+async def export_month(month, out_dir):
+    first_day, next_month = month_range(month)
+    path = os.path.join(out_dir, f"daily_totals_{month}.csv.gz")
+    os.makedirs(out_dir, exist_ok=True)
+    rows = 0
+    async with app.session() as session:
+        result = await session.stream(
+            select(
+                DailyTotal.business_day,
+                DailyTotal.user_id,
+                User.nickname,
+                User.site,
+                User.admin_nickname,
+                User.top_admin,
+                DailyTotal.total_cents,
+                DailyTotal.extra_cents,
+                DailyTotal.count,
+            )
+            .outerjoin(User, User.id == DailyTotal.user_id)
+            .where(
+                DailyTotal.business_day >= first_day,
+                DailyTotal.business_day < next_month,
+                DailyTotal.count > 0,
+            )
+            .order_by(DailyTotal.user_id, DailyTotal.business_day)
+        )
+        with gzip.open(path, "wt", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            async for row in result:
+                writer.writerow(row)
+                rows += 1
+    return path, rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("month", help="месяц в формате YYYY-MM")
+    parser.add_argument("--out", default="archive")
+    args = parser.parse_args()
+
+    async def export_once():
+        try:
+            return await export_month(args.month, args.out)
+        finally:
+            await app.close()
+
+    path, rows = asyncio.run(export_once())
+    print(f"{rows} operator-days -> {path} ({os.path.getsize(path)} bytes)")
@@ -0,0 +1,75 @@
+"""Холодный старт: время импорта модулей и создания общих ресурсов (app.py).
+
+Каждый замер - отдельный процесс python, поэтому кэш модулей не мешает.
+Для main дополнительно замеряется путь до первого запроса к базе:
+импорт, app.engine и SELECT 1. Берётся медиана из --repeat запусков.
+Импорт aiogram замеряется отдельно: это нижняя граница для main, которому
+Dispatcher нужен при импорте; app.py её не уменьшает.
+Запуск: python -m benchmarks.cold_start --repeat 5
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+MODULES = [
+    "aiogram",
+    "app",
+    "database",
+    "rating",
+    "sendrating",
+    "notify_group",
+    "send_logs",
+    "import_balances",
+    "main",
+]
+
+IMPORT_PROBE = """
+import time
+started = time.perf_counter()
+import {module}
+print(time.perf_counter() - started)
+"""
+
+# Импорт main, общий engine и первый запрос - до этого бот не может работать
+READY_PROBE = """
+import asyncio, time
+started = time.perf_counter()
+import main
+from sqlalchemy import text
+
+async def first_query():
+    async with main.app.session() as session:
+        await session.execute(text("SELECT 1"))
+    main.app.bot
+    await main.app.close()
+
+asyncio.run(first_query())
+print(time.perf_counter() - started)
+"""
+
+
+def run_probe(code):
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure(code, repeat):
+    return round(statistics.median(run_probe(code) for _ in range(repeat)) * 1000, 1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    report = {
+        f"import {module}": measure(IMPORT_PROBE.format(module=module), args.repeat)
+        for module in MODULES
+    }
+    report["main ready"] = measure(READY_PROBE, args.repeat)
+    for name, ms in report.items():
+        print(f"{name:<25} {ms:>8.1f} ms")
+    print(json.dumps(report))
@@ -0,0 +1,172 @@
+"""Синтетический набор данных для бенчмарков рейтингов.
+
+Массово загружает операторов, админов и балансы за несколько рабочих суток
+в отдельную базу (SQLite или Postgres) вместе с итогами daily_totals,
+как их вёл бы бот. В Postgres балансы идут через COPY, в SQLite - через
+многострочные INSERT пачками.
+Загрузка очищает таблицы, поэтому база задаётся явно (--database-url или
+BENCH_DATABASE_URL) и не может совпадать с DATABASE_URL бота; непустая
+база очищается только с --force.
+Запуск: python -m benchmarks.dataset --database-url sqlite:///bench.db \\
+    --operators 2000 --admins 60 --balances-per-day 20000 --days 9
+"""
+import argparse
+import asyncio
+import os
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from pytz import utc
+from sqlalchemy import delete, func, insert, select
+
+from app import app
+from buttons import SHIFTS_BY_SITE, SITES
+from database import (DATABASE_URL, DAY_CUTOFF, KYIV_TZ, Balance, DailyTotal,
+                      User, bulk_add_to_daily_totals, bulk_insert_balances,
+                      get_business_day, get_kyiv_timestamp, to_async_url)
+from migrations import run_migrations
+
+BATCH_SIZE = 5000
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--operators", type=int, default=2000)
+    parser.add_argument("--admins", type=int, default=60)
+    parser.add_argument("--top-admins", type=int, default=8)
+    parser.add_argument("--balances-per-day", type=int, default=20000)
+    parser.add_argument(
+        "--days", type=int, default=9, help="число закрытых рабочих суток"
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("BENCH_DATABASE_URL"),
+        help="отдельная база бенчмарка, не DATABASE_URL бота",
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="очистить непустую базу"
+    )
+    return parser.parse_args(argv)
+
+
+def use_bench_database(args):
+    # Направляет app.engine на базу бенчмарка; базу бота не трогаем
+    if not args.database_url:
+        raise SystemExit(
+            "Укажите базу бенчмарка: --database-url или BENCH_DATABASE_URL"
+        )
+    if DATABASE_URL and to_async_url(args.database_url) == to_async_url(DATABASE_URL):
+        raise SystemExit("База бенчмарка совпадает с DATABASE_URL бота")
+    app.database_url = args.database_url
+
+
+def generate_users(operators, admins, top_admins, rng):
+    admin_names = [f"Admin{i}" for i in range(admins)]
+    top_admin_of = {
+        name: f"Top{i % top_admins}" for i, name in enumerate(admin_names)
+    }
+    users = []
+    for i in range(operators):
+        admin_nickname = rng.choice(admin_names)
+        site = rng.choice(SITES)
+        users.append(
+            {
+                "id": i + 1,
+                "telegram_id": 10_000_000 + i,
+                "nickname": f"op{i}",
+                "admin_nickname": admin_nickname,
+                "top_admin": top_admin_of[admin_nickname],
+                "site": site,
+                "shift": rng.choice(SHIFTS_BY_SITE[site]),
+            }
+        )
+    return users
+
+
+def generate_balances(operators, per_day, days, rng, now=None):
+    # Закрытые сутки целиком и текущие сутки до now
+    now = now or get_kyiv_timestamp()
+    today_start = datetime.combine(get_business_day(now), DAY_CUTOFF)
+    for day in range(days, -1, -1):
+        start = today_start - timedelta(days=day)
+        span = (now - start) if day == 0 else timedelta(days=1)
+        minutes = max(int(span.total_seconds() // 60), 1)
+        for _ in range(per_day if day else per_day * minutes // (24 * 60)):
+            amount_cents = rng.randint(100, 50000)
+            draft = f"{amount_cents // 100},{amount_cents % 100:02d}"
+            extra_label = extra_cents = None
+            if rng.random() < 0.3:
+                extra_label, extra_cents = "КС", rng.randint(100, 20000)
+                draft += f" + КС {extra_cents // 100},{extra_cents % 100:02d}"
+            local = start + timedelta(minutes=rng.randrange(minutes))
+            yield {
+                "user_id": rng.randint(1, operators),
+                "amount_cents": amount_cents,
+                "extra_label": extra_label,
+                "extra_cents": extra_cents,
+                "draft": draft,
+                "timestamp": KYIV_TZ.localize(local).astimezone(utc),
+                "business_day": get_business_day(local),
+            }
+
+
+async def load_dataset(args, bind=None):
+    bind = bind or app.engine
+    rng = random.Random(args.seed)
+    started = time.monotonic()
+    await run_migrations(bind)
+    async with bind.connect() as conn:
+        existing = await conn.scalar(select(func.count()).select_from(User))
+    if existing and not args.force:
+        raise SystemExit(
+            f"В базе уже {existing} пользователей; очистить её можно только с --force"
+        )
+    users = generate_users(args.operators, args.admins, args.top_admins, rng)
+    totals = defaultdict(lambda: [0, 0, 0])
+    balances = 0
+    async with bind.begin() as conn:
+        for table in (Balance, DailyTotal, User):
+            await conn.execute(delete(table))
+        await conn.execute(insert(User), users)
+        batch = []
+        for row in generate_balances(
+            args.operators, args.balances_per_day, args.days, rng
+        ):
+            total = totals[(row["user_id"], row["business_day"])]
+            total[0] += row["amount_cents"]
+            total[1] += row["extra_cents"] or 0
+            total[2] += 1
+            batch.append(row)
+            if len(batch) == BATCH_SIZE:
+                await bulk_insert_balances(conn, batch)
+                balances += len(batch)
+                batch = []
+        if batch:
+            await bulk_insert_balances(conn, batch)
+            balances += len(batch)
+        await bulk_add_to_daily_totals(conn, totals)
+        if conn.dialect.name == "postgresql":
+            # Явные id у users - сдвигаем последовательность за них
+            await conn.exec_driver_sql(
+                "SELECT setval('users_id_seq', (SELECT max(id) FROM users))"
+            )
+    return {
+        "users": len(users),
+        "balances": balances,
+        "daily_totals": len(totals),
+        "seconds": round(time.monotonic() - started, 2),
+    }
+
+
+async def main(args):
+    use_bench_database(args)
+    report = await load_dataset(args)
+    await app.close()
+    print(report)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,141 @@
+"""Фейковый Telegram Bot API для проверки исходящей очереди без сети.
+
+Отвечает на sendMessage/sendDocument, может периодически возвращать 429
+с retry_after и считает нарушения лимитов (1/с в личку, 20/мин в группу,
+30/с на бота). Для сравнения polling и вебхука умеет отдавать через
+getUpdates апдейты, добавленные push_update().
+Запуск: python -m benchmarks.fake_bot_api --port 8081
+"""
+import argparse
+import asyncio
+import itertools
+import time
+from collections import defaultdict, deque
+
+from aiohttp import web
+
+PRIVATE_WINDOW, PRIVATE_LIMIT = 1.0, 1
+GROUP_WINDOW, GROUP_LIMIT = 60.0, 20
+GLOBAL_WINDOW, GLOBAL_LIMIT = 1.0, 30
+
+
+class FakeBotAPI:
+    def __init__(self, flood_every=0, retry_after=1, group_limit=GROUP_LIMIT):
+        self.flood_every = flood_every
+        self.group_limit = group_limit
+        self.retry_after = retry_after
+        self.requests = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.chat_history = defaultdict(deque)
+        self.global_history = deque()
+        self.delivered = defaultdict(list)  # chat_id -> тексты в порядке доставки
+        self.delivered_at = defaultdict(list)  # chat_id -> время доставки
+        self.updates = []
+        self.updates_ready = asyncio.Event()
+        self.flood_responses = 0
+        self.violations = 0
+
+    def _over_limit(self, history, now, window, limit):
+        while history and now - history[0] >= window:
+            history.popleft()
+        history.append(now)
+        return len(history) > limit
+
+    def push_update(self, update):
+        self.updates.append(update)
+        self.updates_ready.set()
+
+    async def get_updates(self, data):
+        offset = int(data.get("offset", 0))
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            self.updates_ready.clear()
+            try:
+                await asyncio.wait_for(
+                    self.updates_ready.wait(), float(data.get("timeout", 0))
+                )
+            except asyncio.TimeoutError:
+                pass
+        limit = int(data.get("limit", 100))
+        return web.json_response({"ok": True, "result": self.updates[:limit]})
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        data = dict(await request.post()) or dict(request.query)
+        if method == "getMe":
+            return web.json_response(
+                {
+                    "ok": True,
+                    "result": {"id": 1, "is_bot": True, "first_name": "Fake"},
+                }
+            )
+        if method == "getUpdates":
+            return await self.get_updates(data)
+        if method in ("setWebhook", "deleteWebhook"):
+            return web.json_response({"ok": True, "result": True})
+        if self.flood_every and next(self.requests) % self.flood_every == 0:
+            self.flood_responses += 1
+            return web.json_response(
+                {
+                    "ok": False,
+                    "error_code": 429,
+                    "description": f"Too Many Requests: retry after {self.retry_after}",
+                    "parameters": {"retry_after": self.retry_after},
+                }
+            )
+        chat_id = int(data.get("chat_id", 0))
+        now = time.monotonic()
+        if chat_id < 0:
+            window, limit = GROUP_WINDOW, self.group_limit
+        else:
+            window, limit = PRIVATE_WINDOW, PRIVATE_LIMIT
+        if self._over_limit(self.chat_history[chat_id], now, window, limit):
+            self.violations += 1
+        if self._over_limit(self.global_history, now, GLOBAL_WINDOW, GLOBAL_LIMIT):
+            self.violations += 1
+        self.delivered[chat_id].append(data.get("text"))
+        self.delivered_at[chat_id].append(now)
+        chat_type = "supergroup" if chat_id < 0 else "private"
+        return web.json_response(
+            {
+                "ok": True,
+                "result": {
+                    "message_id": next(self.message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": chat_type},
+                    "text": data.get("text") or "",
+                },
+            }
+        )
+
+    async def stats(self, request):
+        return web.json_response(
+            {
+                "delivered": sum(len(texts) for texts in self.delivered.values()),
+                "flood_responses": self.flood_responses,
+                "violations": self.violations,
+            }
+        )
+
+    def make_app(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        app.router.add_get("/stats", self.stats)
+        return app
+
+
+async def start_fake_server(api, host="127.0.0.1", port=8081):
+    runner = web.AppRunner(api.make_app())
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--flood-every", type=int, default=0)
+    args = parser.parse_args()
+    web.run_app(
+        FakeBotAPI(flood_every=args.flood_every).make_app(), port=args.port
+    )
@@ -0,0 +1,144 @@
+"""Бенчмарк рассылок рейтингов: каждая send_* на синтетических данных.
+
+Telegram подменяется заглушкой, которая только запоминает текст. Для каждой
+задачи замеряются время, число SQL-запросов и пик памяти (tracemalloc) -
+холодный прогон со сброшенными кэшами и повторный. Результаты пишутся в
+JSON, а --compare печатает разницу с прошлым прогоном.
+База задаётся как в benchmarks.dataset (--database-url или BENCH_DATABASE_URL).
+Запуск: python -m benchmarks.rating_jobs --database-url sqlite:///bench.db \\
+            --operators 2000 --out bench.json
+        python -m benchmarks.rating_jobs --database-url sqlite:///bench.db \\
+            --skip-load --compare bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import event
+
+import rating
+import sendrating
+from app import app
+from benchmarks.dataset import load_dataset
+from benchmarks.dataset import parse_args as dataset_args
+from benchmarks.dataset import use_bench_database
+
+JOBS = [
+    "send_rating",
+    "send_admin_rating",
+    "send_top_admin_rating",
+    "send_weekly_rating",
+    "send_weekly_admin_rating",
+    "send_weekly_top_admin_rating",
+]
+METRICS = ["seconds", "queries", "peak_kb"]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--out", default="benchmarks/results/rating_jobs.json")
+    parser.add_argument("--compare", help="JSON прошлого прогона")
+    parser.add_argument("--skip-load", action="store_true", help="данные уже в базе")
+    parser.add_argument("--repeat", type=int, default=3)
+    args, rest = parser.parse_known_args()
+    return args, dataset_args(rest)
+
+
+class QueryCounter:
+    def __init__(self, bind):
+        self.count = 0
+        event.listen(bind.sync_engine, "before_cursor_execute", self.on_execute)
+
+    def on_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self.count += 1
+
+
+def reset_caches():
+    rating._snapshots.clear()
+    rating.rating_index = rating.PrefixSumIndex()
+
+
+async def measure(job, counter):
+    counter.count = 0
+    tracemalloc.start()
+    started = time.perf_counter()
+    await job()
+    seconds = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "seconds": round(seconds, 4),
+        "queries": counter.count,
+        "peak_kb": round(peak / 1024, 1),
+    }
+
+
+async def run(args, data_args):
+    use_bench_database(data_args)
+    dataset = None
+    if not args.skip_load:
+        dataset = await load_dataset(data_args)
+        print(f"dataset: {dataset}")
+
+    sent = []
+
+    async def fake_send(chat_id, message):
+        sent.append(len(message))
+
+    sendrating.send_rating_message = fake_send
+    counter = QueryCounter(app.engine)
+    results = {}
+    for name in JOBS:
+        job = getattr(sendrating, name)
+        reset_caches()
+        cold = await measure(job, counter)
+        warm = [await measure(job, counter) for _ in range(args.repeat)]
+        results[name] = {
+            "cold": cold,
+            "warm": min(warm, key=lambda result: result["seconds"]),
+            "message_chars": sent[-1],
+        }
+    dialect = app.engine.dialect.name
+    await app.close()
+    return {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "dialect": dialect,
+        "python": platform.python_version(),
+        "dataset": dataset or vars(data_args),
+        "jobs": results,
+    }
+
+
+def print_report(report, previous=None):
+    print(f"{'job':<30} {'run':<5} " + " ".join(f"{m:>18}" for m in METRICS))
+    for name, result in report["jobs"].items():
+        for run_name in ("cold", "warm"):
+            cells = []
+            for metric in METRICS:
+                value = result[run_name][metric]
+                cell = f"{value}"
+                if previous and name in previous["jobs"]:
+                    before = previous["jobs"][name][run_name][metric]
+                    if before:
+                        cell += f" ({(value - before) / before:+.0%})"
+                cells.append(f"{cell:>18}")
+            print(f"{name:<30} {run_name:<5} " + " ".join(cells))
+
+
+if __name__ == "__main__":
+    args, data_args = parse_args()
+    report = asyncio.run(run(args, data_args))
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            previous = json.load(f)
+    print_report(report, previous)
+    os.makedirs(os.path.dirname(args.out) or ".", exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saved to {args.out}")
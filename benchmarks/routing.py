@@ -0,0 +1,136 @@
+"""Стоимость маршрутизации одного апдейта: цепочка lambda-фильтров против TextRouter.
+
+Оба варианта прогоняются через настоящий aiogram Router, поэтому в замер
+входит и накладной расход aiogram на проверку каждого фильтра.
+Запуск: python -m benchmarks.routing
+"""
+import asyncio
+import re
+import time
+from datetime import datetime
+
+from aiogram import Router
+from aiogram.types import Chat, Message, User
+
+from buttons import (BACK, NEXT_PAGE, NEXT_STEP, PREVIOUS_PAGE, SEND_BALANCE,
+                     SHIFTS, SITES, TOP_ADMINS)
+from routing import BALANCE_PATTERN, TextRouter
+
+CHAT_ID = "-100"
+REGISTERED = 1
+IN_PROGRESS = 2
+user_data = {IN_PROGRESS: {"nickname": "Test"}}
+
+
+async def handler(message):
+    return None
+
+
+# Фильтры в том порядке и виде, в каком они стояли в main.py
+LEGACY_FILTERS = [
+    lambda message: message.text == "Отправить баланс",
+    lambda message: re.match(
+        r"^\d+([.,]\d{1,2})?(\s*\+\s*\w+\s*\d+([.,]\d{1,2})?)?$",
+        message.text,
+        re.IGNORECASE,
+    ),
+    lambda message: message.text == "Назад",
+    lambda message: message.from_user.id not in user_data,
+    lambda message: message.text in ["LF", "MV"],
+    lambda message: message.text
+    in [
+        "00:00-06:00",
+        "06:00-12:00",
+        "12:00-18:00",
+        "18:00-00:00",
+        "00:00-08:00",
+        "08:00-16:00",
+        "16:00-00:00",
+    ],
+    lambda message: message.text == "Следующий шаг",
+    lambda message: message.text == "➡ Далее",
+    lambda message: message.text == "⬅ Назад",
+    lambda message: message.text in TOP_ADMINS.keys(),
+    lambda message: message.chat.id == int(CHAT_ID),
+    lambda message: True,
+]
+
+legacy_router = Router(name="legacy")
+for message_filter in LEGACY_FILTERS:
+    legacy_router.message(message_filter)(handler)
+
+text_router = TextRouter()
+text_router.route(SEND_BALANCE, BACK)(handler)
+text_router.route(
+    *SITES,
+    *SHIFTS,
+    NEXT_STEP,
+    NEXT_PAGE,
+    PREVIOUS_PAGE,
+    *TOP_ADMINS,
+    registration_step=True,
+)(handler)
+
+table_router = Router(name="table")
+
+
+@table_router.message()
+async def route_message(message):
+    if message.chat.id == int(CHAT_ID):
+        return
+    text = message.text
+    route = text_router.resolve(text)
+    if route is not None and not route.registration_step:
+        await route(message, None, None)
+    elif BALANCE_PATTERN.match(text):
+        await handler(message)
+    elif message.from_user.id not in user_data:
+        await handler(message)
+    elif route is not None:
+        await route(message, None, None)
+    else:
+        await handler(message)
+
+
+def make_message(text, user_id):
+    return Message(
+        message_id=1,
+        date=datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="Test"),
+        text=text,
+    )
+
+
+SAMPLES = [
+    make_message("20,50 + КС 100,43", REGISTERED),
+    make_message("112,50", REGISTERED),
+    make_message(SEND_BALANCE, REGISTERED),
+    make_message("16:00-00:00", IN_PROGRESS),
+    make_message("Merch", IN_PROGRESS),
+    make_message("привет", REGISTERED),
+]
+
+
+async def measure(router, rounds=3000):
+    best = None
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(rounds):
+            for message in SAMPLES:
+                await router.propagate_event("message", message)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best / (rounds * len(SAMPLES)) * 1e6
+
+
+async def main():
+    legacy = await measure(legacy_router)
+    table = await measure(table_router)
+    print(f"lambda filter chain: {legacy:8.1f} us/update")
+    print(f"TextRouter:          {table:8.1f} us/update")
+    print(f"speedup:             {legacy / table:8.1f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""Нагрузка на исходящую очередь через фейковый Bot API.
+
+Отправляет пачку ответов пользователям, уведомлений в группу и отчётов,
+проверяет, что лимиты не нарушены, 429 обработаны, а ответы пользователям
+доставлены быстрее остального.
+Запуск: python -m benchmarks.sender_load --users 40 --notifications 60
+"""
+import argparse
+import asyncio
+import os
+import time
+from collections import defaultdict
+
+PORT = 8099
+GROUP_CHAT_ID = -100
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--notifications", type=int, default=60)
+    parser.add_argument("--reports", type=int, default=3)
+    parser.add_argument("--flood-every", type=int, default=25)
+    # Групповой лимит 20/мин растягивает прогон, поэтому в тесте его можно ускорить
+    parser.add_argument("--group-rate", type=float, default=20.0)
+    return parser.parse_args()
+
+
+async def run(args):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+
+    from benchmarks.fake_bot_api import FakeBotAPI, start_fake_server
+    from sender import GROUP_NOTIFICATION, REPORT, USER_REPLY, outbound
+
+    # Фейковый сервер проверяет тот же групповой лимит, что выставлен очереди
+    api = FakeBotAPI(
+        flood_every=args.flood_every, group_limit=round(args.group_rate * 60)
+    )
+    runner = await start_fake_server(api, port=PORT)
+    bot = Bot(
+        token="123456:TEST",
+        session=AiohttpSession(
+            api=TelegramAPIServer.from_base(f"http://127.0.0.1:{PORT}")
+        ),
+    )
+    outbound.start(bot)
+
+    latencies = defaultdict(list)
+
+    async def send(chat_id, text, priority):
+        started = time.monotonic()
+        await outbound.send_message(chat_id, text, priority=priority)
+        latencies[priority].append(time.monotonic() - started)
+
+    jobs = [send(GROUP_CHAT_ID, f"report {i}", REPORT) for i in range(args.reports)]
+    jobs += [
+        send(GROUP_CHAT_ID, f"notification {i}", GROUP_NOTIFICATION)
+        for i in range(args.notifications)
+    ]
+    jobs += [send(1000 + i, f"reply {i}", USER_REPLY) for i in range(args.users)]
+    started = time.monotonic()
+    await asyncio.gather(*jobs)
+    elapsed = time.monotonic() - started
+
+    await outbound.stop()
+    await bot.session.close()
+    await runner.cleanup()
+
+    names = {USER_REPLY: "user replies", GROUP_NOTIFICATION: "notifications"}
+    names[REPORT] = "reports"
+    print(f"total: {elapsed:.2f}s, sender stats: {outbound.stats()}")
+    for priority, values in sorted(latencies.items()):
+        values.sort()
+        p50 = values[len(values) // 2]
+        print(
+            f"{names[priority]:>14}: n={len(values)} "
+            f"p50={p50:.3f}s max={values[-1]:.3f}s"
+        )
+    print(f"429 responses: {api.flood_responses}, limit violations: {api.violations}")
+    in_order = all(
+        texts == sorted(texts, key=lambda text: int(text.split()[-1]))
+        for chat_id, texts in api.delivered.items()
+        if chat_id != GROUP_CHAT_ID
+    )
+    print(f"private chats delivered in order: {in_order}")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.environ["TELEGRAM_GROUP_CHAT_RATE"] = str(args.group_rate)
+    asyncio.run(run(args))
@@ -0,0 +1,196 @@
+"""Сравнение доставки апдейтов: long polling против вебхука.
+
+Одни и те же записанные апдейты (JSONL, по одному Update на строку) либо
+отдаются боту через getUpdates фейкового Bot API, либо отправляются POST-ом
+на вебхук. Задержка апдейта - от подачи до ответа бота на фейковом сервере.
+Без --updates генерируются команды /top и /me от разных пользователей.
+Запуск: python -m benchmarks.webhook_load --mode both --updates 500
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import tempfile
+import time
+
+API_PORT = 8098
+WEBHOOK_PORT = 8097
+SECRET = "benchmark-secret"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--mode", choices=["polling", "webhook", "both"], default="both")
+    parser.add_argument("--updates", type=int, default=500)
+    parser.add_argument("--recorded", help="JSONL с записанными апдейтами")
+    parser.add_argument("--max-tasks", type=int, default=32)
+    return parser.parse_args()
+
+
+def generate_updates(count):
+    updates = []
+    for i in range(count):
+        user_id = 1000 + i
+        updates.append(
+            {
+                "update_id": i + 1,
+                "message": {
+                    "message_id": i + 1,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "from": {"id": user_id, "is_bot": False, "first_name": "User"},
+                    "text": "/top" if i % 2 else "/me",
+                },
+            }
+        )
+    return updates
+
+
+def load_updates(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def expected_replies(updates):
+    # Каждый апдейт даёт один ответ в свой чат
+    counts = {}
+    for update in updates:
+        chat_id = update["message"]["chat"]["id"]
+        counts[chat_id] = counts.get(chat_id, 0) + 1
+    return counts
+
+
+async def wait_for_replies(api, expected, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if all(len(api.delivered_at[chat_id]) >= n for chat_id, n in expected.items()):
+            return True
+        await asyncio.sleep(0.01)
+    return False
+
+
+def report(mode, updates, submitted_at, api, elapsed, ack_times=None):
+    seen = {}
+    latencies = []
+    for update, started in zip(updates, submitted_at):
+        chat_id = update["message"]["chat"]["id"]
+        index = seen.get(chat_id, 0)
+        seen[chat_id] = index + 1
+        replies = api.delivered_at[chat_id]
+        if index < len(replies):
+            latencies.append(replies[index] - started)
+    latencies.sort()
+    print(f"\n{mode}: {len(latencies)}/{len(updates)} ответов за {elapsed:.2f}s")
+    print(f"  пропускная способность: {len(latencies) / elapsed:.1f} апдейтов/с")
+    if latencies:
+        print(
+            f"  задержка p50 {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms, "
+            f"max {latencies[-1] * 1000:.1f} ms"
+        )
+    if ack_times:
+        print(f"  ответ вебхука 200: p50 {statistics.median(ack_times) * 1000:.2f} ms")
+
+
+async def run_polling(main, updates):
+    from benchmarks.fake_bot_api import FakeBotAPI, start_fake_server
+
+    api = FakeBotAPI()
+    runner = await start_fake_server(api, port=API_PORT)
+    main.outbound.start(main.app.bot)
+    polling = asyncio.create_task(
+        main.dp.start_polling(
+            main.app.bot, handle_signals=False, close_bot_session=False, polling_timeout=1
+        )
+    )
+    started = time.monotonic()
+    submitted_at = []
+    for update in updates:
+        submitted_at.append(time.monotonic())
+        api.push_update(update)
+    await wait_for_replies(api, expected_replies(updates))
+    elapsed = time.monotonic() - started
+    await main.dp.stop_polling()
+    await polling
+    await main.outbound.stop()
+    await runner.cleanup()
+    report("polling", updates, submitted_at, api, elapsed)
+
+
+async def run_webhook(main, updates, max_tasks):
+    import aiohttp
+
+    from benchmarks.fake_bot_api import FakeBotAPI, start_fake_server
+    from webhook import WEBHOOK_PATH, start_webhook
+
+    api = FakeBotAPI()
+    runner = await start_fake_server(api, port=API_PORT)
+    main.outbound.start(main.app.bot)
+    webhook_runner = await start_webhook(
+        main.dp,
+        main.app.bot,
+        host="127.0.0.1",
+        port=WEBHOOK_PORT,
+        max_tasks=max_tasks,
+        secret_token=SECRET,
+    )
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}"
+    headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+    submitted_at = [0.0] * len(updates)
+    ack_times = []
+    async with aiohttp.ClientSession() as client:
+        async with client.post(url, json=updates[0], headers={}) as response:
+            assert response.status == 401, "вебхук принял запрос без секрета"
+
+        async def post(i, update):
+            submitted_at[i] = time.monotonic()
+            async with client.post(url, json=update, headers=headers) as response:
+                response.raise_for_status()
+            ack_times.append(time.monotonic() - submitted_at[i])
+
+        started = time.monotonic()
+        await asyncio.gather(*(post(i, u) for i, u in enumerate(updates[1:], 1)))
+        # Первый апдейт отвергнут без секрета - отправляем его заново
+        await post(0, updates[0])
+        await wait_for_replies(api, expected_replies(updates))
+        elapsed = time.monotonic() - started
+    await webhook_runner.cleanup()
+    await main.outbound.stop()
+    await runner.cleanup()
+    report("webhook", updates, submitted_at, api, elapsed, sorted(ack_times))
+
+
+async def run(args):
+    # Окружение задаётся до импорта main: бот смотрит на фейковый Bot API,
+    # лимиты исходящей очереди не должны искажать замер входящего потока
+    os.environ.setdefault("TELEGRAM_API_TOKEN", "123456:TEST")
+    os.environ.setdefault("CHAT_ID", "-100")
+    os.environ["TELEGRAM_API_SERVER"] = f"http://127.0.0.1:{API_PORT}"
+    os.environ.setdefault("TELEGRAM_GLOBAL_RATE", "100000")
+    os.environ.setdefault("TELEGRAM_PRIVATE_CHAT_RATE", "100000")
+    if "DATABASE_URL" not in os.environ:
+        path = os.path.join(tempfile.mkdtemp(), "bench.db")
+        os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    # Логи бенчмарка (SQL, access-лог вебхука) - во временный каталог,
+    # а не в bot.log рабочего бота
+    log_dir = tempfile.mkdtemp(prefix="webhook_load_logs_")
+    os.environ["LOG_DIR"] = log_dir
+
+    import main
+
+    main.setup_logging()
+    await main.run_migrations()
+    updates = load_updates(args.recorded) if args.recorded else generate_updates(
+        args.updates
+    )
+    if args.mode in ("polling", "both"):
+        await run_polling(main, updates)
+    if args.mode in ("webhook", "both"):
+        await run_webhook(main, updates, args.max_tasks)
+    await main.app.close()
+    print(f"logs: {log_dir}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -0,0 +1,45 @@
+# Тексты кнопок - единый источник для клавиатур, маршрутизации и базы
+
+SEND_BALANCE = "Отправить баланс"
+BACK = "Назад"
+NEXT_STEP = "Следующий шаг"
+NEXT_PAGE = "➡ Далее"
+PREVIOUS_PAGE = "⬅ Назад"
+
+SITES = ("LF", "MV")
+
+SHIFTS_BY_SITE = {
+    "LF": ("00:00-08:00", "08:00-16:00", "16:00-00:00"),
+    "MV": ("00:00-06:00", "06:00-12:00", "12:00-18:00", "18:00-00:00"),
+}
+SHIFTS = tuple(shift for shifts in SHIFTS_BY_SITE.values() for shift in shifts)
+
+# Словарь соответствий админов и топ-админов
+TOP_ADMINS = {
+    "Tanos": "Deadpool",
+    "Leviks": "Deadpool",
+    "Guts": "Stern",
+    "Griffit": "Creator",
+    "Mysterion": "Stern",
+    "Scarlett": "Stern",
+    "Eterial": "Stern",
+    "Warden": "Creator",
+    "Butcher": "Deadpool",
+    "Valkyrie": "Creator",
+    "Gallileo": "Deadpool",
+    "Ultimatum": "Creator",
+    "Unique": "Stern",
+    "Hunter": "Stern",
+    "Kuber": "Deadpool",
+    "Jaconda": "Deadpool",
+    "Quiettt": "Stern",
+    "Alien": "Stern",
+    "Merch": "Stern",
+}
+
+# Админы на страницах клавиатуры выбора администратора
+ADMINS_PER_FIRST_PAGE = 9
+ADMIN_PAGES = (
+    tuple(TOP_ADMINS)[:ADMINS_PER_FIRST_PAGE],
+    tuple(TOP_ADMINS)[ADMINS_PER_FIRST_PAGE:],
+)
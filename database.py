@@ -1,21 +1,105 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from sqlalchemy import Date, Text, TypeDecorator, delete, insert, make_url, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import declarative_base
 import os
 from dotenv import load_dotenv
-from datetime import datetime
-from pytz import timezone
+from datetime import datetime, time, timedelta
+from pytz import timezone, utc
 from sqlalchemy import BigInteger
 
+from buttons import TOP_ADMINS
+
 # Загружаем переменные окружения
 load_dotenv()
 
-# Подключение к базе данных с использованием SQLAlchemy
+# Асинхронные драйверы для DATABASE_URL вида postgresql:// и sqlite://
+ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def to_async_url(url):
+    url = make_url(url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver and url.get_driver_name() != driver:
+        url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    return url
+
+
 DATABASE_URL = os.getenv("DATABASE_URL")
-engine = create_engine(DATABASE_URL, echo=True)
 
-# Debugging: print the database connection URL
-print("Подключение к базе данных:", engine.url)
-print("Строка подключения:", os.getenv("DATABASE_URL"))
+
+def create_engine(url=None):
+    # Engine с ограниченным пулом; общий для процесса - app.engine (app.py).
+    # SQL в лог - только SQL_ECHO=1 или /sqlecho (log_setup.set_sql_echo)
+    url = to_async_url(url or DATABASE_URL)
+    if url.get_backend_name() == "sqlite":
+        pool_options = {}  # aiosqlite работает без пула соединений
+    else:
+        pool_options = {
+            "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+            "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "5")),
+            "pool_timeout": int(os.getenv("DB_POOL_TIMEOUT", "30")),
+            "pool_pre_ping": True,
+        }
+    return create_async_engine(url, **pool_options)
+
+
+KYIV_TZ = timezone("Europe/Kiev")
+
+# Рабочие сутки рейтинга: с 09:00 одного дня до 09:00 следующего
+DAY_CUTOFF = time(9, 0)
+
+
+def get_kyiv_timestamp():
+    # Время Киева без tzinfo, с точностью до минуты
+    return datetime.now(KYIV_TZ).replace(second=0, microsecond=0, tzinfo=None)
+
+
+def get_utc_timestamp():
+    # Время UTC с tzinfo, с точностью до минуты - так хранится balances.timestamp
+    return datetime.now(utc).replace(second=0, microsecond=0)
+
+
+def get_business_day(timestamp):
+    # Время с tzinfo переводится в киевское; без tzinfo считается киевским
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(KYIV_TZ)
+    day = timestamp.date()
+    if timestamp.time() < DAY_CUTOFF:
+        day -= timedelta(days=1)
+    return day
+
+
+class UtcDateTime(TypeDecorator):
+    """Время с tzinfo, хранится в UTC.
+
+    Время без tzinfo не принимается: по нему не понять, киевское оно или UTC.
+    SQLite хранит время без пояса, поэтому при чтении ему возвращается UTC.
+    """
+
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            raise ValueError(f"Время без tzinfo: {value}")
+        return value.astimezone(utc)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if value.tzinfo is None:
+            return value.replace(tzinfo=utc)
+        return value.astimezone(utc)
+
+
+def _default_business_day(context):
+    # Для вставок без business_day: рабочие сутки по timestamp той же строки
+    return get_business_day(context.get_current_parameters()["timestamp"])
+
 
 # Создаём базовый класс для моделей
 Base = declarative_base()
@@ -33,6 +117,11 @@ class User(Base):
     site = Column(String, nullable=True)  # Добавлено поле для сайта
     shift = Column(String, nullable=True)  # Добавлено поле для смены
 
+    __table_args__ = (
+        Index("ix_users_admin_nickname", "admin_nickname"),
+        Index("ix_users_top_admin", "top_admin"),
+    )
+
 
 # Определяем таблицу балансов
 class Balance(Base):
@@ -40,42 +129,66 @@ class Balance(Base):
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=False)  # ID из таблицы users
-    balance = Column(Float, nullable=False)
+    # Части баланса в целых центах, разобраны один раз (routing.parse_balance):
+    # основная сумма и необязательная вторая часть с подписью (например, КС)
+    amount_cents = Column(BigInteger, nullable=False)
+    extra_label = Column(String, nullable=True)
+    extra_cents = Column(BigInteger, nullable=True)
     draft = Column(String, nullable=False)  # Добавлено поле для полного баланса
-    timestamp = Column(
-        DateTime,
-        default=lambda: datetime.now(timezone("Europe/Kiev")).replace(
-            second=0, microsecond=0
-        ),
-    )  # Новая колонка для даты и времени (только дата, часы и минуты)
-
-
-# Словарь соответствий админов и топ-админов
-top_admins = {
-    "Tanos": "Deadpool",
-    "Leviks": "Deadpool",
-    "Guts": "Stern",
-    "Griffit": "Creator",
-    "Mysterion": "Stern",
-    "Scarlett": "Stern",
-    "Eterial": "Stern",
-    "Warden": "Creator",
-    "Butcher": "Deadpool",
-    "Valkyrie": "Creator",
-    "Gallileo": "Deadpool",
-    "Ultimatum": "Creator",
-    "Unique": "Stern",
-    "Hunter": "Stern",
-    "Kuber": "Deadpool",
-    "Jaconda": "Deadpool",
-    "Quiettt": "Stern",
-    "Alien": "Stern",
-    "Merch": "Stern",
-}
+    # Время записи в UTC, с точностью до минуты
+    timestamp = Column(UtcDateTime, nullable=False, default=get_utc_timestamp)
+    # Рабочие сутки записи (с 09:00 по Киеву), считаются один раз при вставке
+    business_day = Column(Date, nullable=False, default=_default_business_day)
+
+    __table_args__ = (
+        Index("ix_balances_user_id_business_day", "user_id", "business_day"),
+        Index("ix_balances_user_id_id_desc", "user_id", id.desc()),
+        Index("ix_balances_business_day", "business_day"),
+    )
+
+
+# Итоги оператора за рабочие сутки, обновляются вместе с каждой записью баланса
+class DailyTotal(Base):
+    __tablename__ = "daily_totals"
+
+    user_id = Column(Integer, primary_key=True)
+    business_day = Column(Date, primary_key=True)
+    # Суммы в центах: total_cents - основные (рейтинг), extra_cents - вторые части
+    total_cents = Column(BigInteger, nullable=False, default=0)
+    extra_cents = Column(BigInteger, nullable=False, default=0)
+    count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (Index("ix_daily_totals_business_day", "business_day"),)
+
+
+# Состояние FSM (шаги регистрации), общее для всех воркеров
+class FsmRecord(Base):
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)  # bot_id:chat_id:user_id
+    state = Column(String, nullable=True)
+    data = Column(Text, nullable=True)  # JSON
+    expires_at = Column(Integer, nullable=True)  # unix time, продлевается записью
+
+    __table_args__ = (Index("ix_fsm_states_expires_at", "expires_at"),)
+
+
+# Запуски задач планировщика: строка на задачу и день, её вставляет один воркер
+class JobRun(Base):
+    __tablename__ = "job_runs"
+
+    job_name = Column(String, primary_key=True)
+    run_day = Column(Date, primary_key=True)
+    worker = Column(String, nullable=True)
+    claimed_at = Column(DateTime, default=get_kyiv_timestamp)
+
+
+# Соответствие админов и топ-админов, список ведётся в buttons.py
+top_admins = TOP_ADMINS
 
 
 # Функция для добавления пользователя
-def add_user(session, telegram_id, nickname, admin_nickname, site, shift):
+async def add_user(session, telegram_id, nickname, admin_nickname, site, shift):
     top_admin = top_admins.get(admin_nickname)  # Получаем топ-админа из словаря
     new_user = User(
         telegram_id=telegram_id,
@@ -87,12 +200,148 @@ def add_user(session, telegram_id, nickname, admin_nickname, site, shift):
     )
 
     session.add(new_user)
-    session.commit()
+    await session.commit()
+    return new_user
+
+
+_upsert_dialects = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _daily_total_upsert(dialect_name, values):
+    # INSERT итогов; при конфликте суммы и число записей прибавляются
+    stmt = _upsert_dialects[dialect_name](DailyTotal).values(values)
+    return stmt.on_conflict_do_update(
+        index_elements=[DailyTotal.user_id, DailyTotal.business_day],
+        set_={
+            "total_cents": DailyTotal.total_cents + stmt.excluded.total_cents,
+            "extra_cents": DailyTotal.extra_cents + stmt.excluded.extra_cents,
+            "count": DailyTotal.count + stmt.excluded.count,
+        },
+    )
+
+
+async def _add_to_daily_total(session, user_id, business_day, parts, count):
+    await session.execute(
+        _daily_total_upsert(
+            session.bind.dialect.name,
+            {
+                "user_id": user_id,
+                "business_day": business_day,
+                "total_cents": parts.amount_cents,
+                "extra_cents": parts.extra_cents or 0,
+                "count": count,
+            },
+        )
+    )
+
+
+# Функция для записи состояния FSM: обновляются только переданные колонки
+async def save_fsm_record(session, key, **values):
+    dialect_insert = _upsert_dialects[session.bind.dialect.name]
+    stmt = dialect_insert(FsmRecord).values(key=key, **values)
+    stmt = stmt.on_conflict_do_update(index_elements=[FsmRecord.key], set_=values)
+    await session.execute(stmt)
+    await session.commit()
+
+
+# Функция для записи баланса вместе с итогом за рабочие сутки
+# parts - routing.BalanceParts, timestamp - время с tzinfo, по умолчанию текущее
+async def add_balance(session, user_id, parts, draft, timestamp=None):
+    timestamp = timestamp or get_utc_timestamp()
+    business_day = get_business_day(timestamp)
+    new_balance = Balance(
+        user_id=user_id,
+        amount_cents=parts.amount_cents,
+        extra_label=parts.extra_label,
+        extra_cents=parts.extra_cents,
+        draft=draft,
+        timestamp=timestamp,
+        business_day=business_day,
+    )
+    session.add(new_balance)
+    await _add_to_daily_total(session, user_id, business_day, parts, 1)
+    await session.commit()
+    return new_balance
+
+
+# Функция для удаления записи баланса с откатом итога за рабочие сутки
+async def remove_balance(session, balance):
+    await session.execute(
+        update(DailyTotal)
+        .where(
+            DailyTotal.user_id == balance.user_id,
+            DailyTotal.business_day == balance.business_day,
+        )
+        .values(
+            total_cents=DailyTotal.total_cents - balance.amount_cents,
+            extra_cents=DailyTotal.extra_cents - (balance.extra_cents or 0),
+            count=DailyTotal.count - 1,
+        )
+    )
+    await session.delete(balance)
+    await session.commit()
+
+
+# Массовая запись балансов: COPY в Postgres, многострочные INSERT в SQLite.
+# rows - словари с user_id, amount_cents, extra_label, extra_cents, draft,
+# timestamp (с tzinfo) и business_day
+BULK_BALANCE_COLUMNS = [
+    "user_id",
+    "amount_cents",
+    "extra_label",
+    "extra_cents",
+    "draft",
+    "timestamp",
+    "business_day",
+]
+
+
+async def bulk_insert_balances(conn, rows):
+    if conn.dialect.name == "postgresql":
+        raw = await conn.get_raw_connection()
+        await raw.driver_connection.copy_records_to_table(
+            "balances",
+            columns=BULK_BALANCE_COLUMNS,
+            records=[
+                (
+                    row["user_id"],
+                    row["amount_cents"],
+                    row["extra_label"],
+                    row["extra_cents"],
+                    row["draft"],
+                    row["timestamp"].astimezone(utc),
+                    row["business_day"],
+                )
+                for row in rows
+            ],
+        )
+    else:
+        await conn.execute(insert(Balance), rows)
+
+
+# Массовое прибавление к итогам:
+# totals - {(user_id, business_day): (центы, центы КС, число записей)}
+async def bulk_add_to_daily_totals(conn, totals, batch_size=1000):
+    rows = [
+        {
+            "user_id": user_id,
+            "business_day": day,
+            "total_cents": total_cents,
+            "extra_cents": extra_cents,
+            "count": count,
+        }
+        for (user_id, day), (total_cents, extra_cents, count) in totals.items()
+    ]
+    for i in range(0, len(rows), batch_size):
+        await conn.execute(
+            _daily_total_upsert(conn.dialect.name, rows[i : i + batch_size])
+        )
 
 
-# Создаём таблицы в базе (если их нет)
-Base.metadata.create_all(engine)
+# Функция для удаления пользователя со всеми балансами и итогами
+async def delete_user(session, user_id):
+    await session.execute(delete(Balance).where(Balance.user_id == user_id))
+    await session.execute(delete(DailyTotal).where(DailyTotal.user_id == user_id))
+    await session.execute(delete(User).where(User.id == user_id))
+    await session.commit()
 
-# Создаём сессию для работы с базой
-Session = sessionmaker(bind=engine)
-session = Session()
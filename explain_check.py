@@ -0,0 +1,118 @@
+import sys
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from app import app
+from database import Balance, User
+from migrations import run_migrations
+from rating import get_kyiv_time, operator_totals_query
+
+
+def hot_queries():
+    today = get_kyiv_time().date()
+    since = today - timedelta(days=9)
+    return [
+        (
+            "user by telegram_id",
+            "users",
+            select(User).where(User.telegram_id == 1),
+        ),
+        (
+            "latest balance of user",
+            "balances",
+            select(Balance)
+            .where(Balance.user_id == 1)
+            .order_by(Balance.id.desc())
+            .limit(1),
+        ),
+        (
+            "user balances in window",
+            "balances",
+            select(func.sum(Balance.amount_cents)).where(
+                Balance.user_id == 1,
+                Balance.business_day >= since,
+                Balance.business_day <= today,
+            ),
+        ),
+        (
+            "old balances retention",
+            "balances",
+            select(Balance.id).where(Balance.business_day < since),
+        ),
+        (
+            "operators of admin",
+            "users",
+            select(User).where(User.admin_nickname == "Tanos"),
+        ),
+        (
+            "operators of top admin",
+            "users",
+            select(User).where(User.top_admin == "Stern"),
+        ),
+        (
+            "rating snapshot",
+            "daily_totals",
+            operator_totals_query(since, today),
+        ),
+    ]
+
+
+def explain(conn, statement):
+    compiled = statement.compile(dialect=conn.dialect)
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    if conn.dialect.name == "postgresql":
+        rows = conn.exec_driver_sql(f"EXPLAIN {compiled}", params).all()
+        return [row[0] for row in rows]
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+    return [row[-1] for row in rows]
+
+
+def is_sequential_scan(dialect_name, line, table):
+    if dialect_name == "postgresql":
+        return f"Seq Scan on {table}" in line
+    # SQLite: SEARCH - поиск по индексу, SCAN - полный проход таблицы или индекса
+    return line.strip().startswith(f"SCAN {table}")
+
+
+def _check_query_plans(conn):
+    failures = []
+    dialect_name = conn.dialect.name
+    if dialect_name == "postgresql":
+        # На маленькой таблице планировщик и так выберет Seq Scan,
+        # поэтому проверяем, что индексный путь вообще существует.
+        conn.exec_driver_sql("SET LOCAL enable_seqscan = off")
+    for name, table, statement in hot_queries():
+        plan = explain(conn, statement)
+        if any(is_sequential_scan(dialect_name, line, table) for line in plan):
+            failures.append((name, plan))
+    conn.rollback()
+    return failures
+
+
+async def check_query_plans(bind=None):
+    async with (bind or app.engine).connect() as conn:
+        return await conn.run_sync(_check_query_plans)
+
+
+async def main():
+    try:
+        await run_migrations()
+        return await check_query_plans()
+    finally:
+        await app.close()
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    failures = asyncio.run(main())
+    for name, plan in failures:
+        print(f"Sequential scan in '{name}':")
+        for line in plan:
+            print(f"    {line}")
+    if failures:
+        sys.exit(1)
+    print("All hot queries use indexes.")
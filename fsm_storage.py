@@ -0,0 +1,178 @@
+import json
+import os
+import sys
+from collections import OrderedDict
+from time import monotonic, time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from sqlalchemy import delete, func, or_, select
+
+from app import app
+from database import FsmRecord, save_fsm_record
+
+# Незаконченная регистрация удаляется после суток без действий пользователя
+REGISTRATION_TTL = int(os.getenv("REGISTRATION_TTL", str(24 * 60 * 60)))
+
+
+class StateRecord:
+    __slots__ = ("state", "data", "expires_at")
+
+    def __init__(self):
+        self.state = None
+        self.data = {}
+        self.expires_at = 0.0
+
+
+class TTLMemoryStorage(BaseStorage):
+    """FSM-хранилище в памяти процесса с истечением записей.
+
+    В отличие от MemoryStorage не заводит запись на каждое чтение: хранятся
+    только незаконченные регистрации, и каждая живёт ttl секунд после
+    последнего шага.
+    """
+
+    def __init__(self, ttl=REGISTRATION_TTL):
+        self.ttl = ttl
+        self.records = OrderedDict()  # (chat_id, user_id) -> StateRecord, старые первыми
+
+    def _get(self, key):
+        record = self.records.get((key.chat_id, key.user_id))
+        if record is not None and record.expires_at <= monotonic():
+            del self.records[(key.chat_id, key.user_id)]
+            return None
+        return record
+
+    def _save(self, key, record):
+        record_key = (key.chat_id, key.user_id)
+        if record.state is None and not record.data:
+            self.records.pop(record_key, None)
+            return
+        record.expires_at = monotonic() + self.ttl
+        self.records[record_key] = record
+        self.records.move_to_end(record_key)
+        self._evict_expired()
+
+    def _evict_expired(self):
+        now = monotonic()
+        while self.records:
+            record_key, record = next(iter(self.records.items()))
+            if record.expires_at > now:
+                break
+            del self.records[record_key]
+
+    async def set_state(self, key, state=None):
+        record = self._get(key) or StateRecord()
+        record.state = state.state if isinstance(state, State) else state
+        self._save(key, record)
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key, data):
+        record = self._get(key) or StateRecord()
+        record.data = data.copy()
+        self._save(key, record)
+
+    async def get_data(self, key):
+        record = self._get(key)
+        return record.data.copy() if record else {}
+
+    async def purge(self):
+        self._evict_expired()
+
+    async def stats(self):
+        memory = sys.getsizeof(self.records)
+        for record_key, record in self.records.items():
+            memory += sys.getsizeof(record_key) + sys.getsizeof(record)
+            memory += sys.getsizeof(record.data) + sum(
+                sys.getsizeof(value) for value in record.data.values()
+            )
+        return {"pending_registrations": len(self.records), "size_bytes": memory}
+
+    async def close(self):
+        pass
+
+
+class SQLStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_states, общее для всех воркеров.
+
+    Локально работает и на SQLite - этого достаточно для проверки режима
+    нескольких процессов без Postgres.
+    """
+
+    def __init__(self, session_pool, ttl=REGISTRATION_TTL):
+        self.session_pool = session_pool
+        self.ttl = ttl
+        self.key_builder = DefaultKeyBuilder()
+
+    async def _get(self, key):
+        async with self.session_pool() as session:
+            record = await session.get(FsmRecord, self.key_builder.build(key))
+        if record is None or (record.expires_at or 0) <= time():
+            return None
+        return record
+
+    async def _save(self, key, **values):
+        key = self.key_builder.build(key)
+        now = int(time())
+        async with self.session_pool() as session:
+            # Истёкшая запись не должна вернуться вместе с новым шагом
+            await session.execute(
+                delete(FsmRecord).where(
+                    FsmRecord.key == key, FsmRecord.expires_at <= now
+                )
+            )
+            await save_fsm_record(session, key, expires_at=now + self.ttl, **values)
+            if values.get("state") is None and values.get("data", "{}") == "{}":
+                # Пустые записи не храним: регистрация закончена или сброшена
+                await session.execute(
+                    delete(FsmRecord).where(
+                        FsmRecord.key == key,
+                        FsmRecord.state.is_(None),
+                        or_(FsmRecord.data.is_(None), FsmRecord.data == "{}"),
+                    )
+                )
+                await session.commit()
+
+    async def set_state(self, key, state=None):
+        state = state.state if isinstance(state, State) else state
+        await self._save(key, state=state)
+
+    async def get_state(self, key):
+        record = await self._get(key)
+        return record.state if record else None
+
+    async def set_data(self, key, data):
+        await self._save(key, data=json.dumps(data))
+
+    async def get_data(self, key):
+        record = await self._get(key)
+        return json.loads(record.data) if record and record.data else {}
+
+    async def purge(self):
+        async with self.session_pool() as session:
+            await session.execute(
+                delete(FsmRecord).where(FsmRecord.expires_at <= int(time()))
+            )
+            await session.commit()
+
+    async def stats(self):
+        async with self.session_pool() as session:
+            count, size = (
+                await session.execute(
+                    select(func.count(), func.sum(func.length(FsmRecord.data)))
+                )
+            ).one()
+        return {"pending_registrations": count, "size_bytes": size or 0}
+
+    async def close(self):
+        pass
+
+
+def create_storage():
+    # FSM_STORAGE=sql - состояние в базе, нужно для нескольких воркеров
+    if os.getenv("FSM_STORAGE", "memory") == "sql":
+        return SQLStorage(app.session)
+    return TTLMemoryStorage()
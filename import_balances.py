@@ -0,0 +1,208 @@
+"""Массовый импорт балансов из CSV или JSONL (например, после сбоя).
+
+Колонки/ключи: telegram_id или nickname, draft, timestamp (ISO 8601, без
+зоны - киевское время) и необязательный amount. draft проверяется той же
+грамматикой, что сообщения в catch_balance, сумма берётся из него же.
+Пользователи ищутся пачками одним запросом, балансы пишутся COPY (Postgres)
+или многострочными INSERT (SQLite), итоги daily_totals обновляются в той же
+транзакции. При ошибках в строках импорт отменяется целиком, если не указан
+--skip-invalid.
+Повторный импорт того же файла задвоит балансы.
+Запуск: python import_balances.py balances.csv more.jsonl.gz
+"""
+import argparse
+import asyncio
+import csv
+import gzip
+import json
+import time
+from collections import defaultdict
+from datetime import datetime
+
+from pytz import utc
+from sqlalchemy import select
+
+from app import app
+from database import (KYIV_TZ, User, bulk_add_to_daily_totals,
+                      bulk_insert_balances, get_business_day)
+from routing import parse_balance
+
+BATCH_SIZE = 5000
+SHOWN_ERRORS = 20
+
+
+def open_text(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", newline="", encoding="utf-8")
+    return open(path, newline="", encoding="utf-8")
+
+
+def read_records(path):
+    # (номер строки, словарь) без чтения всего файла в память
+    with open_text(path) as f:
+        if path.removesuffix(".gz").endswith((".jsonl", ".json")):
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, json.loads(line)
+        else:
+            for line_number, record in enumerate(csv.DictReader(f), start=2):
+                yield line_number, record
+
+
+def parse_amount(text):
+    return float(str(text).strip().replace(",", "."))
+
+
+def parse_timestamp(value):
+    # Время без зоны считается киевским; хранится UTC
+    timestamp = datetime.fromisoformat(str(value).strip())
+    if timestamp.tzinfo is None:
+        timestamp = KYIV_TZ.localize(timestamp)
+    return timestamp.astimezone(utc)
+
+
+def parse_record(record):
+    # -> (ключ пользователя, части баланса, draft, timestamp); ValueError с причиной
+    draft = str(record.get("draft") or "").strip()
+    parts = parse_balance(draft)
+    if parts is None:
+        raise ValueError(f"неверный формат баланса: {draft!r}")
+    if record.get("amount") not in (None, ""):
+        if round(parse_amount(record["amount"]) * 100) != parts.amount_cents:
+            raise ValueError(f"amount {record['amount']} не совпадает с draft")
+    if not record.get("timestamp"):
+        raise ValueError("нет timestamp")
+    timestamp = parse_timestamp(record["timestamp"])
+    if record.get("telegram_id") not in (None, ""):
+        user_key = ("telegram_id", int(record["telegram_id"]))
+    elif record.get("nickname"):
+        user_key = ("nickname", str(record["nickname"]).strip())
+    else:
+        raise ValueError("нет telegram_id или nickname")
+    return user_key, parts, draft, timestamp
+
+
+class UserResolver:
+    """telegram_id/nickname -> users.id, по одному запросу на пачку новых ключей."""
+
+    def __init__(self):
+        self.ids = {}  # (поле, значение) -> id, None - нет или ник не уникален
+
+    async def resolve(self, conn, keys):
+        for field in ("telegram_id", "nickname"):
+            missing = {
+                value
+                for key_field, value in keys
+                if key_field == field and (key_field, value) not in self.ids
+            }
+            if not missing:
+                continue
+            column = getattr(User, field)
+            found = defaultdict(list)
+            for user_id, value in await conn.execute(
+                select(User.id, column).where(column.in_(missing))
+            ):
+                found[value].append(user_id)
+            for value in missing:
+                ids = found.get(value, [])
+                self.ids[(field, value)] = ids[0] if len(ids) == 1 else None
+
+    def get(self, key):
+        return self.ids.get(key)
+
+
+async def import_files(paths, skip_invalid=False, batch_size=BATCH_SIZE):
+    started = time.monotonic()
+    resolver = UserResolver()
+    totals = defaultdict(lambda: [0, 0, 0])
+    errors = []
+    imported = 0
+
+    async def flush(conn, batch):
+        nonlocal imported
+        await resolver.resolve(conn, {user_key for _, _, user_key, *_ in batch})
+        rows = []
+        for path, line_number, user_key, parts, draft, timestamp in batch:
+            user_id = resolver.get(user_key)
+            if user_id is None:
+                reason = f"пользователь не найден или ник не уникален: {user_key[1]}"
+                errors.append((path, line_number, reason))
+                continue
+            business_day = get_business_day(timestamp)
+            rows.append(
+                {
+                    "user_id": user_id,
+                    "amount_cents": parts.amount_cents,
+                    "extra_label": parts.extra_label,
+                    "extra_cents": parts.extra_cents,
+                    "draft": draft,
+                    "timestamp": timestamp,
+                    "business_day": business_day,
+                }
+            )
+            total = totals[(user_id, business_day)]
+            total[0] += parts.amount_cents
+            total[1] += parts.extra_cents or 0
+            total[2] += 1
+        if rows and (skip_invalid or not errors):
+            # После первой ошибки без --skip-invalid только проверяем строки
+            await bulk_insert_balances(conn, rows)
+            imported += len(rows)
+
+    async with app.engine.connect() as conn:
+        transaction = await conn.begin()
+        batch = []
+        for path in paths:
+            for line_number, record in read_records(path):
+                try:
+                    batch.append((path, line_number, *parse_record(record)))
+                except (ValueError, TypeError) as e:
+                    errors.append((path, line_number, str(e)))
+                if len(batch) == batch_size:
+                    await flush(conn, batch)
+                    batch = []
+        if batch:
+            await flush(conn, batch)
+        if errors and not skip_invalid:
+            await transaction.rollback()
+            imported = 0
+            totals.clear()
+        else:
+            await bulk_add_to_daily_totals(conn, totals)
+            await transaction.commit()
+    return {
+        "imported": imported,
+        "invalid": len(errors),
+        "operator_days": len(totals),
+        "seconds": round(time.monotonic() - started, 2),
+        "errors": errors,
+    }
+
+
+async def main(args):
+    report = await import_files(args.paths, args.skip_invalid, args.batch_size)
+    await app.close()
+    for path, line_number, reason in report["errors"][:SHOWN_ERRORS]:
+        print(f"{path}:{line_number}: {reason}")
+    if report["invalid"] > SHOWN_ERRORS:
+        print(f"... ещё {report['invalid'] - SHOWN_ERRORS} ошибок")
+    if report["invalid"] and not args.skip_invalid:
+        print("Импорт отменён: исправьте строки или запустите с --skip-invalid")
+        return 1
+    print(
+        f"Импортировано {report['imported']} балансов, пропущено "
+        f"{report['invalid']}, обновлено итогов: {report['operator_days']}, "
+        f"{report['seconds']}s"
+    )
+    # Рейтинг в памяти запущенного бота не знает про импорт
+    print("В запущенном боте отправьте /reload, чтобы обновить рейтинги")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("paths", nargs="+", help="файлы .csv, .jsonl (можно .gz)")
+    parser.add_argument("--skip-invalid", action="store_true")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    raise SystemExit(asyncio.run(main(args)))
@@ -1,10 +1,13 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+from buttons import (ADMIN_PAGES, BACK, NEXT_PAGE, NEXT_STEP, PREVIOUS_PAGE,
+                     SEND_BALANCE, SHIFTS_BY_SITE, SITES)
+
 
 def Main():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="Отправить баланс")],
+            [KeyboardButton(text=SEND_BALANCE)],
         ],
         resize_keyboard=True,
     )
@@ -13,12 +16,7 @@ def Main():
 
 def RegShift():
     keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="00:00-06:00")],
-            [KeyboardButton(text="06:00-12:00")],
-            [KeyboardButton(text="12:00-18:00")],
-            [KeyboardButton(text="18:00-00:00")],
-        ],
+        keyboard=[[KeyboardButton(text=shift)] for shift in SHIFTS_BY_SITE["MV"]],
         resize_keyboard=True,
     )
     return keyboard
@@ -26,11 +24,7 @@ def RegShift():
 
 def RegShiftLF():
     keyboard = ReplyKeyboardMarkup(
-        keyboard=[
-            [KeyboardButton(text="00:00-08:00")],
-            [KeyboardButton(text="08:00-16:00")],
-            [KeyboardButton(text="16:00-00:00")],
-        ],
+        keyboard=[[KeyboardButton(text=shift)] for shift in SHIFTS_BY_SITE["LF"]],
         resize_keyboard=True,
     )
     return keyboard
@@ -39,8 +33,8 @@ def RegShiftLF():
 def RegSecond():
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
-            [KeyboardButton(text="Следующий шаг")],
-            [KeyboardButton(text="Назад")],
+            [KeyboardButton(text=NEXT_STEP)],
+            [KeyboardButton(text=BACK)],
         ],
         resize_keyboard=True,
     )
@@ -48,37 +42,12 @@ def RegSecond():
 
 
 def RegThree(page=1):
-    buttons_page1 = [
-        "Tanos",
-        "Leviks",
-        "Guts",
-        "Griffit",
-        "Mysterion",
-        "Scarlett",
-        "Eterial",
-        "Warden",
-        "Butcher",
-    ]
-
-    buttons_page2 = [
-        "Valkyrie",
-        "Gallileo",
-        "Ultimatum",
-        "Unique",
-        "Hunter",
-        "Kuber",
-        "Jaconda",
-        "Quiettt",
-        "Alien",
-        "Merch",
-    ]
+    buttons_page1, buttons_page2 = ADMIN_PAGES
 
     if page == 1:
-        buttons = buttons_page1[:] + [
-            "➡ Далее"
-        ]  # Используем копию, чтобы избежать дублирования
+        buttons = list(buttons_page1) + [NEXT_PAGE]
     else:
-        buttons = ["⬅ Назад"] + buttons_page2
+        buttons = [PREVIOUS_PAGE] + list(buttons_page2)
 
     keyboard = ReplyKeyboardMarkup(
         keyboard=[
@@ -96,7 +65,7 @@ def RegThree(page=1):
 
 def RegFive():
     keyboard = ReplyKeyboardMarkup(
-        keyboard=[[KeyboardButton(text="LF")], [KeyboardButton(text="MV")]],
+        keyboard=[[KeyboardButton(text=site)] for site in SITES],
         resize_keyboard=True,
     )
     return keyboard
@@ -0,0 +1,97 @@
+from itertools import islice
+
+from sqlalchemy import select
+
+from sortedcontainers import SortedList
+
+from database import DailyTotal, User, get_business_day, get_kyiv_timestamp
+
+
+class Leaderboard:
+    """Рейтинг текущих рабочих суток в памяти процесса.
+
+    Обновляется на каждую запись и удаление баланса, поэтому /top и /me
+    отвечают без запросов к базе. Ранг и топ-N - O(log n) через SortedList.
+    Суммы хранятся в целых центах, top() и rank() отдают доллары.
+    """
+
+    def __init__(self):
+        self.business_day = None
+        self.totals = {}  # user_id -> (центы, число балансов) за рабочие сутки
+        self.ranking = SortedList()  # (-центы, user_id)
+        self.users = {}  # user_id -> (site, nickname, admin_nickname)
+        self.by_telegram_id = {}  # telegram_id -> user_id
+
+    def _roll_over(self, business_day):
+        if business_day != self.business_day:
+            self.business_day = business_day
+            self.totals.clear()
+            self.ranking.clear()
+
+    def set_user(self, user):
+        self.users[user.id] = (user.site, user.nickname, user.admin_nickname)
+        self.by_telegram_id[user.telegram_id] = user.id
+
+    def remove_user(self, user):
+        self.users.pop(user.id, None)
+        self.by_telegram_id.pop(user.telegram_id, None)
+        entry = self.totals.pop(user.id, None)
+        if entry is not None:
+            self.ranking.remove((-entry[0], user.id))
+
+    def add(self, user_id, amount_cents, business_day, count=1):
+        # Удаление баланса - это add с отрицательной суммой и count=-1
+        current_day = get_business_day(get_kyiv_timestamp())
+        self._roll_over(current_day)
+        if business_day != current_day:
+            return
+        total, balances = self.totals.pop(user_id, (0, 0))
+        if balances:
+            self.ranking.remove((-total, user_id))
+        total += amount_cents
+        balances += count
+        if balances > 0:
+            self.totals[user_id] = (total, balances)
+            self.ranking.add((-total, user_id))
+
+    def top(self, limit=10):
+        self._roll_over(get_business_day(get_kyiv_timestamp()))
+        return [
+            (self.users.get(user_id), -negative_total / 100)
+            for negative_total, user_id in islice(self.ranking, limit)
+        ]
+
+    def rank(self, telegram_id):
+        # (место, сумма, всего участников) или None, если сегодня балансов нет
+        self._roll_over(get_business_day(get_kyiv_timestamp()))
+        user_id = self.by_telegram_id.get(telegram_id)
+        if user_id not in self.totals:
+            return None
+        total = self.totals[user_id][0]
+        place = self.ranking.index((-total, user_id)) + 1
+        return place, total / 100, len(self.ranking)
+
+    async def load(self, session):
+        # Сначала читаем всё из базы, потом подменяем состояние без await между
+        # шагами, чтобы /top и /me не увидели рейтинг наполовину загруженным
+        business_day = get_business_day(get_kyiv_timestamp())
+        users = (await session.scalars(select(User))).all()
+        totals = (
+            await session.execute(
+                select(
+                    DailyTotal.user_id, DailyTotal.total_cents, DailyTotal.count
+                ).where(DailyTotal.business_day == business_day, DailyTotal.count > 0)
+            )
+        ).all()
+        self.business_day = None
+        self._roll_over(business_day)
+        self.users.clear()
+        self.by_telegram_id.clear()
+        for user in users:
+            self.set_user(user)
+        for user_id, total, count in totals:
+            self.totals[user_id] = (total, count)
+            self.ranking.add((-total, user_id))
+
+
+leaderboard = Leaderboard()
@@ -0,0 +1,129 @@
+"""Логи бота: запись в файлы в фоновом потоке, ротация и уровни подсистем.
+
+Событийный цикл только кладёт запись в очередь (QueueHandler), в файлы
+пишет QueueListener в своём потоке. Файлы ротируются по размеру и по
+времени, старые сжимаются в .gz. SQL пишется в лог только при SQL_ECHO=1
+или после set_sql_echo(True), например командой /sqlecho.
+"""
+import atexit
+import gzip
+import logging
+import os
+import queue
+import shutil
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_DIR = os.getenv("LOG_DIR", ".")
+# В режиме воркеров у каждого процесса свои файлы: bot-worker0.log и т.д.
+LOG_SUFFIX = os.getenv("LOG_SUFFIX", "")
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+LOG_ROTATE_HOURS = float(os.getenv("LOG_ROTATE_HOURS", "24"))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", "14"))
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+# Уровни подсистем по умолчанию; LOG_LEVELS="apscheduler=INFO,aiogram=DEBUG"
+DEFAULT_LEVELS = {
+    "apscheduler": "WARNING",
+    "aiogram.event": "WARNING",
+    "aiohttp.access": "WARNING",
+    "sqlalchemy.engine": "WARNING",
+}
+
+_listener = None
+
+
+def log_path(name):
+    return os.path.join(LOG_DIR, f"{name}{LOG_SUFFIX}.log")
+
+
+def _compress(source, dest):
+    with open(source, "rb") as f_in, gzip.open(dest, "wb") as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(source)
+
+
+class RotatingCompressedFileHandler(RotatingFileHandler):
+    """Ротация по размеру или по возрасту файла; старые файлы - name.N.log.gz."""
+
+    def __init__(self, filename, max_bytes, max_age, backup_count):
+        super().__init__(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+        self.max_age = max_age
+        self.rollover_at = time.time() + max_age
+        self.namer = lambda name: name + ".gz"
+        self.rotator = _compress
+
+    def shouldRollover(self, record):
+        if self.max_age and time.time() >= self.rollover_at:
+            if self.stream is None:
+                self.stream = self._open()
+            # Пустой файл по времени не ротируем
+            if self.stream.tell() > 0:
+                return True
+            self.rollover_at = time.time() + self.max_age
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self.rollover_at = time.time() + self.max_age
+
+
+def parse_levels(text):
+    levels = dict(DEFAULT_LEVELS)
+    for item in filter(None, (part.strip() for part in text.split(","))):
+        name, _, level = item.partition("=")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def _file_handler(name, accept):
+    handler = RotatingCompressedFileHandler(
+        log_path(name), LOG_MAX_BYTES, LOG_ROTATE_HOURS * 3600, LOG_BACKUPS
+    )
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handler.addFilter(accept)
+    return handler
+
+
+def set_sql_echo(enabled):
+    # Уровень проверяется при открытии соединения, поэтому работает на лету
+    level = logging.INFO if enabled else logging.WARNING
+    logging.getLogger("sqlalchemy.engine").setLevel(level)
+
+
+def setup_logging():
+    global _listener
+    if _listener is not None:
+        return
+    handlers = [
+        # bot.log - всё, кроме отдельного журнала медленных апдейтов
+        _file_handler("bot", lambda record: record.name != "slow_log"),
+        _file_handler("detailed", lambda record: record.name == "detailed"),
+        _file_handler("slow", lambda record: record.name == "slow_log"),
+    ]
+    records = queue.SimpleQueue()
+    _listener = QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+
+    root = logging.getLogger()
+    root.handlers = [QueueHandler(records)]
+    root.setLevel(logging.INFO)
+    for name, level in parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+    if os.getenv("SQL_ECHO") == "1":
+        set_sql_echo(True)
+
+
+def stop_logging():
+    # Дописывает записи из очереди и останавливает поток записи
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
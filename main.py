@@ -1,200 +1,336 @@
 import asyncio
 import logging
 import os
-import re
-from datetime import datetime, time, timedelta
-import pytz
-from aiogram import Bot, Dispatcher, types
-from aiogram.filters import Command
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram import Dispatcher, types
+from aiogram.filters import Command, CommandObject
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from aiogram.types import Message
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from dotenv import load_dotenv
+from sqlalchemy import select
 from sqlalchemy.exc import SQLAlchemyError
-from sqlalchemy.orm import sessionmaker
-
-from database import Balance, User, add_user, engine, top_admins
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import app
+from buttons import (BACK, NEXT_PAGE, NEXT_STEP, PREVIOUS_PAGE, SEND_BALANCE,
+                     SHIFTS, SITES, TOP_ADMINS)
+from database import (Balance, add_balance, add_user, delete_user,
+                      get_business_day, get_kyiv_timestamp, remove_balance)
+from fsm_storage import create_storage
 from keyboards import Main, RegFive, RegSecond, RegShift, RegShiftLF, RegThree
-from notify_group import notify_group
-from send_logs import log_restart
-from sendrating import (send_admin_rating, send_rating, send_top_admin_rating,
-                        send_weekly_admin_rating, send_weekly_rating,
-                        send_weekly_top_admin_rating)
+from leaderboard import leaderboard
+from log_setup import set_sql_echo, setup_logging
+from metrics import (METRICS_PORT, HandlerMetricsMiddleware,
+                     TelegramMetricsMiddleware, UpdateMetricsMiddleware,
+                     instrument_engine, instrument_scheduler, name_handler,
+                     register_gauge, start_metrics_server)
+from rating import (RATING_KINDS, get_today_kyiv, invalidate_ratings,
+                    parse_rating_day)
+from middlewares import DbSessionMiddleware
+from migrations import run_migrations
+from notify_group import drain_notifications, schedule_notification
+from retention import ensure_balance_partitions, purge_old_balances
+from routing import BALANCE_PATTERN, TextRouter, parse_balance
+from send_logs import LOG_SHIP_MINUTES, log_restart, ship_logs
+from send_logs import MY_ID as LOG_OWNER_ID
+from sender import USER_REPLY, outbound
+from sendrating import (format_range_rating, send_admin_rating, send_rating,
+                        send_top_admin_rating, send_weekly_admin_rating,
+                        send_weekly_rating, send_weekly_top_admin_rating)
+from tracer import QueryTraceMiddleware, trace_queries, traced_job
+from user_cache import user_cache
+from webhook import start_webhook, webhook_url
+from workers import run_once
 
 load_dotenv()
 
 # bot.log - иформация детальная о боте
 # detailed.log - информация о перезапуске бота
 
+# URL - публичный адрес бота; если задан, апдейты приходят через вебхук
 URL = os.getenv("URL") or ""
 CHAT_ID = os.getenv("CHAT_ID") or ""
-API_TOKEN = os.getenv("TELEGRAM_API_TOKEN") or ""
-
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher(storage=MemoryStorage())
+MY_ID = os.getenv("MY_ID") or ""
+LEADERBOARD_SYNC_SECONDS = int(os.getenv("LEADERBOARD_SYNC_SECONDS", "10"))
 
-Session = sessionmaker(bind=engine)
-session = Session()
+# Bot и engine общие для процесса и создаются при первом обращении (app.py)
+# Шаги регистрации хранятся в FSM: в памяти или в базе (FSM_STORAGE=sql)
+dp = Dispatcher(storage=create_storage())
+# Каждый апдейт получает свою короткую сессию из пула
+dp.update.middleware(DbSessionMiddleware(app.session))
+# Кнопки регистрации и навигации: точный текст -> хендлер
+text_router = TextRouter()
 
-user_data = {}
 scheduler = AsyncIOScheduler()
 
-# Configure logging
-logging.basicConfig(
-    filename="bot.log",
-    level=logging.INFO,  # Log INFO level
-    format="%(asctime)s - %(message)s",
-)
-
-detailed_logger = logging.getLogger("detailed")
-detailed_handler = logging.FileHandler("detailed.log")
-detailed_handler.setLevel(logging.INFO)
-detailed_handler.setFormatter(logging.Formatter("%(asctime)s - %(message)s"))
-detailed_logger.addHandler(detailed_handler)
-detailed_logger.setLevel(logging.INFO)
-
-
-def get_kyiv_time():
-    return datetime.now(pytz.timezone("Europe/Kiev"))
+# Метрики для Prometheus: GET /metrics на METRICS_PORT
+dp.update.outer_middleware(UpdateMetricsMiddleware())
+dp.message.middleware(HandlerMetricsMiddleware())
+app.on_bot(lambda bot: bot.session.middleware(TelegramMetricsMiddleware()))
+app.on_engine(instrument_engine)
+instrument_scheduler(scheduler)
+# Запросы на апдейт или задачу, N+1 и медленные апдейты - в slow.log
+dp.update.outer_middleware(QueryTraceMiddleware())
+app.on_engine(trace_queries)
 
 
-def get_today_kyiv():
-    return get_kyiv_time().date()
+async def fsm_stat(name):
+    return (await dp.storage.stats())[name]
 
 
-def get_previous_day_kyiv():
-    return (get_kyiv_time() - timedelta(days=1)).date()
-
-
-def get_week_start_kyiv():
-    return (get_kyiv_time() - timedelta(days=7)).date()
-
+register_gauge(
+    "ratingbot_outbound_queue_depth",
+    "Сообщения в очереди отправки",
+    lambda: outbound.stats()["queue_depth"],
+)
+register_gauge(
+    "ratingbot_outbound_in_flight",
+    "Сообщения, отправляемые прямо сейчас",
+    lambda: outbound.stats()["in_flight"],
+)
+for stat in ("sent", "failed", "retried"):
+    register_gauge(
+        f"ratingbot_outbound_{stat}_total",
+        f"Сообщения очереди отправки: {stat}",
+        lambda stat=stat: outbound.stats()[stat],
+        kind="counter",
+    )
+register_gauge(
+    "ratingbot_fsm_pending_registrations",
+    "Незаконченные регистрации",
+    lambda: fsm_stat("pending_registrations"),
+)
+register_gauge(
+    "ratingbot_fsm_size_bytes",
+    "Размер хранилища FSM, байт",
+    lambda: fsm_stat("size_bytes"),
+)
+register_gauge(
+    "ratingbot_db_pool_checked_out",
+    "Соединения пула, занятые сессиями",
+    lambda: app.pool_stat("checkedout"),
+)
+register_gauge(
+    "ratingbot_db_pool_size", "Размер пула соединений", lambda: app.pool_stat("size")
+)
+register_gauge(
+    "ratingbot_db_pool_overflow",
+    "Соединения сверх pool_size",
+    lambda: app.pool_stat("overflow"),
+)
 
-def is_within_time_range(timestamp, start_time, end_time):
-    return start_time <= timestamp.time() <= end_time
+# Логи: bot.log, detailed.log и slow.log пишутся в фоновом потоке (log_setup.py),
+# поток запускает main(), а не импорт модуля
+detailed_logger = logging.getLogger("detailed")
 
 
-def delete_old_balances():
+async def delete_old_balances():
     try:
-        nine_days_ago = get_kyiv_time() - timedelta(days=9)
-        session.query(Balance).filter(Balance.timestamp < nine_days_ago).delete()
-        session.commit()
+        report = await purge_old_balances()
+        if report["reconciled"]:
+            invalidate_ratings()
         detailed_logger.info(
-            "SQL query execution time: Old balances deleted successfully."
+            f"Old balances deleted: {report['removed']} rows in "
+            f"{report['duration']:.2f}s; operator-days reconciled: "
+            f"{report['reconciled']}"
         )
     except SQLAlchemyError as e:
-        session.rollback()
-        detailed_logger.error(f"SQL query execution time: Database error: {e}")
+        detailed_logger.error(f"Old balances purge failed: Database error: {e}")
 
 
-async def send_rating_message(chat_id, message):
-    try:
-        await bot.send_message(chat_id=chat_id, text=message)
-    except Exception as e:
-        detailed_logger.error(f"Failed to send message: {e}")
+async def reply(message: Message, text, **kwargs):
+    # Ответы пользователям идут через общую очередь с наивысшим приоритетом
+    return await outbound.send_message(
+        message.chat.id, text, priority=USER_REPLY, **kwargs
+    )
 
 
 """Ситстеменые команды"""
 
 
 @dp.message(Command(commands=["rbalance"]))
-async def remove_last_balance(message: Message):
+async def remove_last_balance(message: Message, session: AsyncSession):
     if message.chat.id == int(CHAT_ID):
         return
     try:
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
+        user = await user_cache.get_user(session, message.from_user.id)
         if user:
-            last_balance = (
-                session.query(Balance)
+            last_balance = await session.scalar(
+                select(Balance)
                 .filter_by(user_id=user.id)
                 .order_by(Balance.id.desc())
-                .first()
+                .limit(1)
             )
             if last_balance:
-                session.delete(last_balance)
-                session.commit()
-                await message.answer("Последняя запись баланса удалена.")
+                business_day = last_balance.business_day
+                amount_cents = last_balance.amount_cents
+                await remove_balance(session, last_balance)
+                # Кэши меняем только после успешного удаления из базы
+                leaderboard.add(user.id, -amount_cents, business_day, count=-1)
+                if business_day < get_business_day(get_kyiv_timestamp()):
+                    # изменились итоги закрытых суток
+                    invalidate_ratings(business_day)
+                await reply(message, "Последняя запись баланса удалена.")
             else:
-                await message.answer("Записи баланса не найдены.")
+                await reply(message, "Записи баланса не найдены.")
         else:
-            await message.answer(
-                "Пользователь не найден. Пожалуйста, зарегистрируйтесь сначала."
+            await reply(
+                message,
+                "Пользователь не найден. Пожалуйста, зарегистрируйтесь сначала.",
             )
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-        await message.answer(
-            "Произошла ошибка при удалении записи баланса. Попробуйте еще раз."
+        await reply(
+            message, "Произошла ошибка при удалении записи баланса. Попробуйте еще раз."
         )
 
 
-"""Отправить баланс"""
+RATING_USAGE = (
+    "Использование: /rating <с> <по> [operators|admins|top]\n"
+    "Даты: 2026-10-01, 01.10.2026 или 01.10. "
+    "Рейтинг считается с 09:00 первой даты до 09:00 второй."
+)
 
 
-@dp.message(lambda message: message.text == "Отправить баланс")
-async def send_balance_prompt(message: Message):
+@dp.message(Command(commands=["rating"]))
+async def show_range_rating(
+    message: Message, command: CommandObject, session: AsyncSession
+):
+    if message.chat.id == int(CHAT_ID):
+        return
+    args = (command.args or "").split()
+    today = get_today_kyiv()
+    if len(args) not in (2, 3):
+        await reply(message, RATING_USAGE)
+        return
+    start_day = parse_rating_day(args[0], today)
+    end_day = parse_rating_day(args[1], today)
+    kind = args[2].lower() if len(args) == 3 else "operators"
+    if start_day is None or end_day is None or kind not in RATING_KINDS:
+        await reply(message, RATING_USAGE)
+        return
+    if start_day >= end_day:
+        await reply(message, "Первая дата должна быть раньше второй.")
+        return
+    try:
+        text = await format_range_rating(session, start_day, end_day, kind)
+    except SQLAlchemyError as e:
+        logging.error(f"Database error: {e}")
+        await reply(message, "Не удалось посчитать рейтинг. Попробуйте еще раз.")
+        return
+    await reply(message, text, parse_mode="HTML")
+
+
+@dp.message(Command(commands=["reload"]))
+async def reload_ratings(message: Message, session: AsyncSession):
+    # Только для владельца: после import_balances.py итоги в базе новее кэшей
+    if str(message.from_user.id) != MY_ID:
+        return
+    invalidate_ratings()
+    await leaderboard.load(session)
+    await reply(message, "Рейтинги перечитаны из базы.")
+
+
+@dp.message(Command(commands=["sqlecho"]))
+async def toggle_sql_echo(message: Message, command: CommandObject):
+    # Только для владельца: /sqlecho on|off - SQL-запросы в bot.log
+    if str(message.from_user.id) != MY_ID:
+        return
+    enabled = (command.args or "").strip().lower() == "on"
+    set_sql_echo(enabled)
+    await reply(message, f"SQL в логе: {'включён' if enabled else 'выключен'}.")
+
+
+@dp.message(Command(commands=["top"]))
+async def show_top(message: Message):
     if message.chat.id == int(CHAT_ID):
         return
-    await message.answer(
+    top = leaderboard.top(10)
+    if not top:
+        await reply(message, "С 09:00 ещё никто не отправил баланс.")
+        return
+    lines = ["Текущий рейтинг операторов (с 09:00):\n"]
+    for i, (user, total_balance) in enumerate(top, start=1):
+        site, nickname, admin_nickname = user or ("?", "?", "?")
+        lines.append(
+            f"{i}. {site} ~ {nickname} ({total_balance:.2f}$) - {admin_nickname}"
+        )
+    await reply(message, "\n".join(lines))
+
+
+@dp.message(Command(commands=["me"]))
+async def show_my_rank(message: Message):
+    if message.chat.id == int(CHAT_ID):
+        return
+    if message.from_user.id not in leaderboard.by_telegram_id:
+        await reply(
+            message, "Пользователь не найден. Пожалуйста, зарегистрируйтесь сначала."
+        )
+        return
+    rank = leaderboard.rank(message.from_user.id)
+    if rank is None:
+        await reply(message, "С 09:00 у вас ещё нет записанных балансов.")
+        return
+    place, total_balance, participants = rank
+    await reply(
+        message,
+        f"Ваше место: {place} из {participants}\nБаланс с 09:00: {total_balance:.2f}$",
+    )
+
+
+"""Отправить баланс"""
+
+
+@text_router.route(SEND_BALANCE)
+async def send_balance_prompt(message: Message):
+    await reply(
+        message,
         "Напиши свой баланс в чат в формате - 112,50"
         "\nИли в формате - 20,50 + КС 100,43",
         reply_markup=types.ReplyKeyboardRemove(),
     )
 
 
-@dp.message(
-    lambda message: re.match(
-        r"^\d+([.,]\d{1,2})?(\s*\+\s*\w+\s*\d+([.,]\d{1,2})?)?$",
-        message.text,
-        re.IGNORECASE,
-    )
-)
-async def catch_balance(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
+async def catch_balance(message: Message, session: AsyncSession):
     try:
         draft_text = message.text.strip()  # Full balance string
-        balance_text = re.match(
-            r"^\d+([.,]\d{1,2})?", draft_text
-        ).group()  # Extract first number
-        balance_text = balance_text.replace(",", ".")  # Replace comma with dot
-        balance = float(balance_text)  # Convert to float
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
+        parts = parse_balance(draft_text)  # Amounts in cents, parsed once
+        user = await user_cache.get_user(session, message.from_user.id)
         if user:
-            new_balance = Balance(user_id=user.id, balance=balance, draft=draft_text)
-            session.add(new_balance)
-            session.commit()
-            await message.answer(f"Баланс записан: ${balance}")
-            await notify_group(user.id)  # Notify the group
+            new_balance = await add_balance(session, user.id, parts, draft_text)
+            leaderboard.add(user.id, parts.amount_cents, new_balance.business_day)
+            await reply(message, f"Баланс записан: ${parts.amount_cents / 100}")
+            schedule_notification(user, parts)  # Notify the group
         else:
-            await message.answer(
-                "Пользователь не найден. Пожалуйста, зарегистрируйтесь сначала."
+            await reply(
+                message,
+                "Пользователь не найден. Пожалуйста, зарегистрируйтесь сначала.",
             )
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-        await message.answer("Произошла ошибка при записи баланса. Попробуйте еще раз.")
+        await reply(message, "Произошла ошибка при записи баланса. Попробуйте еще раз.")
 
 
 """Кнопка назад"""
 
 
-@dp.message(lambda message: message.text == "Назад")
-async def back(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
+@text_router.route(BACK)
+async def back(message: Message, session: AsyncSession, state: FSMContext):
     try:
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
+        user = await user_cache.get_user(session, message.from_user.id)
         if user:
-            session.query(Balance).filter_by(user_id=user.id).delete()
-            session.delete(user)
-            session.commit()
-        if message.from_user.id in user_data:
-            del user_data[message.from_user.id]
+            leaderboard.remove_user(user)
+            await delete_user(session, user.id)
+        user_cache.invalidate(message.from_user.id)
+        await state.clear()
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-    await message.answer(
+    await reply(
+        message,
         "\nОкей, напиши мне свой ник!",
         reply_markup=types.ReplyKeyboardRemove(),
     )
@@ -203,166 +339,155 @@ async def back(message: Message):
 """Ник"""
 
 
+class Registration(StatesGroup):
+    # Шаг, который ждёт бот; ник, сайт и смена лежат в данных FSM
+    site = State()
+    shift = State()
+    admin = State()
+
+
 @dp.message(Command(commands=["start"]))
-async def start_registration(message: Message):
+async def start_registration(
+    message: Message, session: AsyncSession, state: FSMContext
+):
     if message.chat.id == int(CHAT_ID):
         return
     try:
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
+        user = await user_cache.get_user(session, message.from_user.id)
         if user:
-            session.query(Balance).filter_by(user_id=user.id).delete()
-            session.delete(user)
-            session.commit()
-        if message.from_user.id in user_data:
-            del user_data[message.from_user.id]
+            leaderboard.remove_user(user)
+            await delete_user(session, user.id)
+        user_cache.invalidate(message.from_user.id)
+        await state.clear()
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-    await message.answer(
+    await reply(
+        message,
         "Привет! Введи свой ник, который будет отображаться в рейтинге!",
     )
 
 
-@dp.message(lambda message: message.from_user.id not in user_data)
-async def catch_nickname(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
+async def catch_nickname(message: Message, session: AsyncSession, state: FSMContext):
     try:
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
+        user = await user_cache.get_user(session, message.from_user.id)
         if user:
-            await message.answer(
+            await reply(
+                message,
                 "Нажмите на кнопку отправить баланс!",
                 reply_markup=Main(),
             )
             return
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-    if message.from_user.id in user_data:
-        return  # Ensure the handler is only called once
     nickname = message.text.strip()  # Извлекаем никнейм, убирая пробелы
-    user_data[message.from_user.id] = {"nickname": nickname}  # Создаём запись в словаре
-    await message.answer(
+    await state.set_data({"nickname": nickname})  # Начинаем регистрацию
+    await state.set_state(Registration.site)
+    await reply(
+        message,
         f"Окей, твой ник: {nickname}\nТеперь выбери свой сайт!",
         reply_markup=RegFive(),
     )
 
 
-@dp.message(lambda message: message.text in ["LF", "MV"])
-async def catch_site(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
+@text_router.route(*SITES, registration_step=True)
+async def catch_site(message: Message, session: AsyncSession, state: FSMContext):
     try:
         site = message.text  # Extract the site
-        user_id = message.from_user.id
-        if user_id in user_data:
-            user_data[user_id]["site"] = site  # Save the site in user_data
+        if await state.get_state() is not None:
+            await state.update_data(site=site)  # Save the site in registration
+            await state.set_state(Registration.shift)
             if site == "LF":
-                await message.answer(
+                await reply(
+                    message,
                     f"Вы выбрали сайт: {site}\nТеперь выберите свою смену!",
                     reply_markup=RegShiftLF(),
                 )
             else:
-                await message.answer(
+                await reply(
+                    message,
                     f"Вы выбрали сайт: {site}\nТеперь выберите свою смену!",
                     reply_markup=RegShift(),
                 )
         else:
-            await message.answer(
+            await reply(
+                message,
                 "Ошибка: Никнейм не найден. Пожалуйста, начните регистрацию сначала.",
                 reply_markup=RegSecond(),
             )
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-        await message.answer(
-            "Произошла ошибка при обработке сайта. Попробуйте еще раз."
+        await reply(
+            message, "Произошла ошибка при обработке сайта. Попробуйте еще раз."
         )
 
 
-@dp.message(
-    lambda message: message.text
-    in [
-        "00:00-06:00",
-        "06:00-12:00",
-        "12:00-18:00",
-        "18:00-00:00",
-        "00:00-08:00",
-        "08:00-16:00",
-        "16:00-00:00",
-    ]
-)
-async def catch_shift(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
+@text_router.route(*SHIFTS, registration_step=True)
+async def catch_shift(message: Message, session: AsyncSession, state: FSMContext):
     try:
         shift = message.text  # Extract the shift
-        user_id = message.from_user.id
-        if user_id in user_data:
-            user_data[user_id]["shift"] = shift  # Save the shift in user_data
-            await message.answer(
+        if await state.get_state() is not None:
+            await state.update_data(shift=shift)  # Save the shift in registration
+            await state.set_state(Registration.admin)
+            await reply(
+                message,
                 f"Вы выбрали смену: {shift}\nТеперь нажмите на кнопку Следующий шаг",
                 reply_markup=RegSecond(),
             )
         else:
-            await message.answer(
+            await reply(
+                message,
                 "Ошибка: Никнейм не найден. Пожалуйста, начните регистрацию сначала.",
                 reply_markup=RegSecond(),
             )
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-        await message.answer(
-            "Произошла ошибка при обработке смены. Попробуйте еще раз."
+        await reply(
+            message, "Произошла ошибка при обработке смены. Попробуйте еще раз."
         )
 
 
-@dp.message(lambda message: message.text == "Следующий шаг")
+@text_router.route(NEXT_STEP, registration_step=True)
 async def next_step(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
-    await message.answer("Выберите ник вашего администратора!", reply_markup=RegThree())
+    await reply(message, "Выберите ник вашего администратора!", reply_markup=RegThree())
 
 
-@dp.message(lambda message: message.text == "➡ Далее")
+@text_router.route(NEXT_PAGE, registration_step=True)
 async def next_page(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
-    await message.answer("Страница 2", reply_markup=RegThree(page=2))
+    await reply(message, "Страница 2", reply_markup=RegThree(page=2))
 
 
-@dp.message(lambda message: message.text == "⬅ Назад")
+@text_router.route(PREVIOUS_PAGE, registration_step=True)
 async def previous_page(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
-    await message.answer("Страница 1", reply_markup=RegThree(page=1))
+    await reply(message, "Страница 1", reply_markup=RegThree(page=1))
 
 
-@dp.message(
-    lambda message: message.text in top_admins.keys()
-)  # Используем ключи top_admins
-async def catch_admin_nickname(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
+@text_router.route(*TOP_ADMINS, registration_step=True)
+async def catch_admin_nickname(
+    message: Message, session: AsyncSession, state: FSMContext
+):
     try:
         admin_nickname = message.text  # Извлекаем ник админа
         user_id = message.from_user.id
-        if user_id in user_data:
-            nickname = user_data[user_id].get("nickname")
-            site = user_data[user_id].get("site")
-            shift = user_data[user_id].get("shift")
+        registration = await state.get_data()
+        if registration:
+            nickname = registration.get("nickname")
+            site = registration.get("site")
+            shift = registration.get("shift")
             if nickname and site and shift:
-                user_data[user_id][
-                    "admin_nickname"
-                ] = admin_nickname  # Сохраняем admin_nickname в словарь
-                user = session.query(User).filter_by(telegram_id=user_id).first()
+                user = await user_cache.get_user(session, user_id)
                 if user:
-                    await message.answer(
+                    await state.clear()
+                    await reply(
+                        message,
                         "У вас уже есть аккаунт. Вы не можете зарегистрироваться снова.",
                         reply_markup=Main(),
                     )
                 else:
-                    add_user(
+                    new_user = await add_user(
                         session,
                         user_id,
                         nickname,
@@ -370,99 +495,118 @@ async def catch_admin_nickname(message: Message):
                         site,
                         shift,
                     )
-                    await message.answer(
+                    leaderboard.set_user(new_user)
+                    user_cache.put(new_user)
+                    await state.clear()  # Регистрация окончена, данные не нужны
+                    await reply(
+                        message,
                         "Регистрация окончена!",
                         reply_markup=Main(),
                     )
             else:
-                await message.answer(
+                await reply(
+                    message,
                     "Ошибка: Никнейм, сайт или смена не найдены. Пожалуйста, начните регистрацию сначала.",
                     reply_markup=RegSecond(),
                 )
         else:
-            await message.answer(
+            await reply(
+                message,
                 "Ошибка: Никнейм не найден. Пожалуйста, начните регистрацию сначала.",
                 reply_markup=RegSecond(),
             )
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
-        await message.answer(
-            "Произошла ошибка при обработке администратора. Попробуйте еще раз."
+        await reply(
+            message,
+            "Произошла ошибка при обработке администратора. Попробуйте еще раз.",
         )
 
 
-@dp.message(lambda message: message.chat.id == int(CHAT_ID))
-async def ignore_group_messages(message: Message):
-    return
-
-
-@dp.message(lambda message: True)
-async def check_registration(message: Message):
-    if message.chat.id == int(CHAT_ID):
-        return
+async def check_registration(
+    message: Message, session: AsyncSession, state: FSMContext
+):
     try:
-        user = session.query(User).filter_by(telegram_id=message.from_user.id).first()
-        if user:
-            if message.text == "/start":
-                await start_registration(message)
-            elif message.text == "/rbalance":
-                await remove_last_balance(message)
-            elif re.match(
-                r"^\d+([.,]\d{1,2})?(\s*\+\s*\w+\s*\d+([.,]\d{1,2})?)?$",
-                message.text,
-                re.IGNORECASE,
-            ):
-                await catch_balance(message)
-            else:
-                return  # Ignore other messages from registered users
-        else:
-            await start_registration(message)
+        user = await user_cache.get_user(session, message.from_user.id)
+        if not user:
+            await start_registration(message, session, state)
+        # Остальные сообщения зарегистрированных пользователей игнорируются
     except SQLAlchemyError as e:
-        session.rollback()
+        await session.rollback()
         logging.error(f"Database error: {e}")
 
 
-async def handle_registration_steps(message: Message):
-    if message.text == "Следующий шаг":
-        await next_step(message)
-    elif message.text == "➡ Далее":
-        await next_page(message)
-    elif message.text == "⬅ Назад":
-        await previous_page(message)
-    elif message.text in top_admins.keys():
-        await catch_admin_nickname(message)
-    elif message.text in ["LF", "MV"]:
-        await catch_site(message)
-    elif message.text in [
-        "00:00-06:00",
-        "06:00-12:00",
-        "12:00-18:00",
-        "18:00-00:00",
-        "00:00-08:00",
-        "08:00-16:00",
-        "16:00-00:00",
-    ]:
-        await catch_shift(message)
-    elif message.from_user.id not in user_data:
-        await catch_nickname(message)
-
-
-async def handle_registered_user_message(message: Message):
-    # Handle messages from registered users here
-    pass
+"""Маршрутизация сообщений"""
+
+
+@dp.message()
+async def route_message(message: Message, session: AsyncSession, state: FSMContext):
+    if message.chat.id == int(CHAT_ID):
+        return  # Сообщения группы игнорируются
+    text = message.text
+    if text is None:
+        await check_registration(message, session, state)
+        return
+    route = text_router.resolve(text)
+    if route is not None and not route.registration_step:
+        name_handler(route.handler)
+        await route(message, session, state)
+    elif BALANCE_PATTERN.match(text):
+        name_handler(catch_balance)
+        await catch_balance(message, session)
+    elif await state.get_state() is None:
+        name_handler(catch_nickname)
+        await catch_nickname(message, session, state)
+    elif route is not None:
+        name_handler(route.handler)
+        await route(message, session, state)
+    else:
+        name_handler(check_registration)
+        await check_registration(message, session, state)
 
 
 # ВРЕМЯ ДЛЯ РЕЙТИНГА  Операторам
 
 
-async def main():
+async def cleanup_registrations():
+    # Удаляем брошенные регистрации и пишем, сколько их и сколько они занимают
+    await dp.storage.purge()
+    stats = await dp.storage.stats()
+    detailed_logger.info(
+        f"Pending registrations: {stats['pending_registrations']}, "
+        f"{stats['size_bytes']} bytes"
+    )
+
+
+async def sync_leaderboard():
+    # Балансы пишут все воркеры, поэтому рейтинг в памяти периодически
+    # перечитывается из daily_totals
+    async with app.session() as session:
+        await leaderboard.load(session)
+
+
+async def main(worker_index=None):
+    # worker_index задан, когда бот запущен несколькими воркерами (workers.py)
+    setup_logging()
+    metrics_runner = None
     try:
+        if worker_index is None:
+            await run_migrations()  # в режиме воркеров их применяет workers.py
+            await ensure_balance_partitions()
+        async with app.session() as session:
+            await leaderboard.load(session)
+            await user_cache.preload(session)
         scheduler.add_job(
-            send_rating, "cron", hour=9, minute=15, second=0, timezone="Europe/Kiev"
+            traced_job(run_once(send_rating)),
+            "cron",
+            hour=9,
+            minute=15,
+            second=0,
+            timezone="Europe/Kiev",
         )
         scheduler.add_job(
-            send_admin_rating,
+            traced_job(run_once(send_admin_rating)),
             "cron",
             hour=9,
             minute=16,
@@ -470,7 +614,7 @@ async def main():
             timezone="Europe/Kiev",
         )
         scheduler.add_job(
-            send_top_admin_rating,
+            traced_job(run_once(send_top_admin_rating)),
             "cron",
             hour=9,
             minute=17,
@@ -478,7 +622,7 @@ async def main():
             timezone="Europe/Kiev",
         )
         scheduler.add_job(
-            send_weekly_rating,
+            traced_job(run_once(send_weekly_rating)),
             "cron",
             day_of_week="mon",
             hour=9,
@@ -487,7 +631,7 @@ async def main():
             timezone="Europe/Kiev",
         )
         scheduler.add_job(
-            send_weekly_admin_rating,
+            traced_job(run_once(send_weekly_admin_rating)),
             "cron",
             day_of_week="mon",
             hour=9,
@@ -496,7 +640,7 @@ async def main():
             timezone="Europe/Kiev",
         )
         scheduler.add_job(
-            send_weekly_top_admin_rating,
+            traced_job(run_once(send_weekly_top_admin_rating)),
             "cron",
             day_of_week="mon",
             hour=9,
@@ -505,7 +649,7 @@ async def main():
             timezone="Europe/Kiev",
         )
         scheduler.add_job(
-            delete_old_balances,
+            traced_job(run_once(delete_old_balances)),
             "cron",
             hour=12,
             minute=0,
@@ -513,16 +657,57 @@ async def main():
             timezone="Europe/Kiev",
         )
 
+        scheduler.add_job(traced_job(cleanup_registrations), "interval", minutes=10)
+        # У каждого воркера свой лог, поэтому и отправка своя
+        if LOG_OWNER_ID is not None:
+            scheduler.add_job(
+                traced_job(ship_logs), "interval", minutes=LOG_SHIP_MINUTES
+            )
+        if worker_index is not None:
+            scheduler.add_job(
+                traced_job(sync_leaderboard),
+                "interval",
+                seconds=LEADERBOARD_SYNC_SECONDS,
+            )
         scheduler.start()
-        detailed_logger.info("Start polling")
-        await dp.start_polling(bot)
+        outbound.start(app.bot)
+        if METRICS_PORT:
+            metrics_runner = await start_metrics_server(
+                port=METRICS_PORT + (worker_index or 0)
+            )
+        if URL:
+            # Вебхук: Telegram сам присылает апдейты на URL + WEBHOOK_PATH.
+            # Воркеры делят один порт, а регистрирует вебхук только первый
+            webhook_runner = await start_webhook(
+                dp,
+                app.bot,
+                URL if worker_index in (None, 0) else None,
+                reuse_port=worker_index is not None,
+            )
+            detailed_logger.info(
+                f"Start webhook {webhook_url(URL)}, worker {worker_index}"
+            )
+            try:
+                await asyncio.Event().wait()
+            finally:
+                await webhook_runner.cleanup()
+        else:
+            # Снимаем вебхук, иначе getUpdates вернёт конфликт
+            await app.bot.delete_webhook()
+            detailed_logger.info("Start polling")
+            await dp.start_polling(app.bot)
     except KeyboardInterrupt:
         detailed_logger.info("Бот завершает работу...")
     finally:
+        await drain_notifications()
+        await outbound.stop()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
         detailed_logger.info("Сессия закрыта.")
-        await bot.session.close()
+        await app.close()
 
 
 if __name__ == "__main__":
+    setup_logging()
     log_restart()
     asyncio.run(main())
@@ -0,0 +1,274 @@
+"""Метрики бота в текстовом формате Prometheus: GET /metrics на METRICS_PORT.
+
+Хендлеры, апдейты, SQL, запросы к Bot API и задачи планировщика
+считаются хуками aiogram, SQLAlchemy и APScheduler; очереди и пул
+читаются в момент запроса. METRICS_PORT=0 отключает сервер.
+"""
+import inspect
+import os
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from time import perf_counter
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiohttp import web
+from apscheduler.events import (EVENT_JOB_ADDED, EVENT_JOB_ERROR,
+                                EVENT_JOB_EXECUTED, EVENT_JOB_MISSED,
+                                EVENT_JOB_SUBMITTED)
+from sqlalchemy import event
+
+from tracer import current_trace
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Воркеры слушают METRICS_PORT + номер воркера
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_metrics = []
+_gauges = {}  # имя -> (описание, read, тип)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = defaultdict(float)
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        self.values[label_values] += amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} counter"
+        for label_values, value in sorted(self.values.items()):
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}{labels} {value:g}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self.values = {}
+        _metrics.append(self)
+
+    def observe(self, *label_values, value):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help_text}"
+        yield f"# TYPE {self.name} histogram"
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(names, label_values + (bound,))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labels, label_values)
+            yield f"{self.name}_sum{labels} {total:g}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+def register_gauge(name, help_text, read, kind="gauge"):
+    # read() -> число, None (метрика пропускается) или awaitable с числом.
+    # Повторная регистрация того же имени заменяет источник
+    _gauges[name] = (help_text, read, kind)
+
+
+async def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, (help_text, read, kind) in _gauges.items():
+        value = read()
+        if inspect.isawaitable(value):
+            value = await value
+        if value is None:
+            continue
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+        lines.append(f"{name} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+handler_seconds = Histogram(
+    "ratingbot_handler_duration_seconds", "Время хендлера", ("handler",)
+)
+updates_total = Counter(
+    "ratingbot_updates_total", "Обработанные апдейты", ("type",)
+)
+updates_dropped = Counter(
+    "ratingbot_updates_dropped_total",
+    "Апдейты без хендлера или с ошибкой",
+    ("reason",),
+)
+db_query_seconds = Histogram(
+    "ratingbot_db_query_duration_seconds", "Время SQL-запроса", ("statement",)
+)
+db_query_errors = Counter(
+    "ratingbot_db_query_errors_total", "Ошибки SQL-запросов", ("statement",)
+)
+telegram_seconds = Histogram(
+    "ratingbot_telegram_request_duration_seconds",
+    "Время запроса к Bot API",
+    ("method",),
+)
+telegram_errors = Counter(
+    "ratingbot_telegram_errors_total", "Ошибки Bot API", ("method", "error")
+)
+job_seconds = Histogram(
+    "ratingbot_job_duration_seconds", "Время задачи планировщика", ("job",)
+)
+job_errors = Counter("ratingbot_job_errors_total", "Задачи с ошибкой", ("job",))
+job_misfires = Counter(
+    "ratingbot_job_misfires_total", "Пропущенные запуски задач", ("job",)
+)
+
+# Хендлер, который реально обработал сообщение (route_message уточняет его)
+_handler_name = ContextVar("handler_name", default=None)
+
+
+def name_handler(handler):
+    holder = _handler_name.get()
+    if holder is not None:
+        holder[0] = handler.__name__
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: сколько пришло и сколько не обработано."""
+
+    async def __call__(self, handler, event, data):
+        updates_total.inc(event.event_type)
+        try:
+            result = await handler(event, data)
+        except Exception:
+            updates_dropped.inc("error")
+            raise
+        if result is UNHANDLED:
+            updates_dropped.inc("unhandled")
+        return result
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        holder = [data["handler"].callback.__name__]
+        token = _handler_name.set(holder)
+        started = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            handler_seconds.observe(holder[0], value=perf_counter() - started)
+            _handler_name.reset(token)
+            trace = current_trace()
+            if trace is not None:
+                trace.handler = holder[0]
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        started = perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            telegram_errors.inc(name, type(e).__name__)
+            raise
+        finally:
+            telegram_seconds.observe(name, value=perf_counter() - started)
+
+
+def _statement_kind(statement):
+    return statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+
+
+def instrument_engine(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        context.metrics_started = perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        db_query_seconds.observe(
+            _statement_kind(statement),
+            value=perf_counter() - context.metrics_started,
+        )
+
+    @event.listens_for(sync_engine, "handle_error")
+    def on_error(context):
+        db_query_errors.inc(_statement_kind(context.statement or ""))
+
+
+def instrument_scheduler(scheduler):
+    names = {}  # job_id -> имя; разовые задачи удаляются из планировщика до запуска
+    running = {}  # job_id -> (имя, начало)
+
+    def job_name(job_id):
+        return names.get(job_id, job_id)
+
+    def on_event(job_event):
+        if job_event.code == EVENT_JOB_ADDED:
+            job = scheduler.get_job(job_event.job_id)
+            if job is not None:
+                names[job.id] = job.name
+        elif job_event.code == EVENT_JOB_SUBMITTED:
+            running[job_event.job_id] = (job_name(job_event.job_id), perf_counter())
+        elif job_event.code == EVENT_JOB_MISSED:
+            job_misfires.inc(job_name(job_event.job_id))
+        elif job_event.job_id in running:
+            name, started = running.pop(job_event.job_id)
+            job_seconds.observe(name, value=perf_counter() - started)
+            if job_event.code == EVENT_JOB_ERROR:
+                job_errors.inc(name)
+
+    scheduler.add_listener(
+        on_event,
+        EVENT_JOB_ADDED
+        | EVENT_JOB_SUBMITTED
+        | EVENT_JOB_EXECUTED
+        | EVENT_JOB_ERROR
+        | EVENT_JOB_MISSED,
+    )
+
+
+async def metrics_handler(request):
+    return web.Response(
+        body=(await render()).encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
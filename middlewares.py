@@ -0,0 +1,17 @@
+from aiogram import BaseMiddleware
+
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Открывает отдельную сессию БД на каждый апдейт и передаёт её хендлерам.
+
+    Сессия не берёт соединение из пула, пока хендлер не сделает запрос,
+    а ошибка и rollback в одном апдейте не затрагивают остальные.
+    """
+
+    def __init__(self, session_pool):
+        self.session_pool = session_pool
+
+    async def __call__(self, handler, event, data):
+        async with self.session_pool() as session:
+            data["session"] = session
+            return await handler(event, data)
@@ -0,0 +1,409 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+
+from sqlalchemy import (Column, Date, DateTime, Float, Integer, MetaData,
+                        String, Table, bindparam, column, delete, func, insert,
+                        inspect, select, table, text, update)
+
+from app import app
+from database import (DAY_CUTOFF, KYIV_TZ, Balance, Base, DailyTotal,
+                      FsmRecord, User, UtcDateTime, get_business_day,
+                      get_kyiv_timestamp)
+from retention import (DEFAULT_PARTITION, PARTITION_DAYS_AHEAD,
+                       RETENTION_DAYS, create_partitions, is_partitioned,
+                       list_partitions)
+from routing import parse_balance
+
+# Служебная таблица с номерами применённых миграций
+metadata = MetaData()
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, server_default=func.now()),
+)
+
+
+BACKFILL_BATCH_SIZE = 10000
+
+# balances до миграции 6: сумма во float, а до миграции 5 timestamp -
+# киевское время без пояса
+legacy_balances = table(
+    "balances",
+    column("id", Integer),
+    column("user_id", Integer),
+    column("balance", Float),
+    column("draft", String),
+    column("timestamp", DateTime),
+    column("business_day", Date),
+)
+
+
+def _columns(conn, table_name):
+    return {column["name"] for column in inspect(conn).get_columns(table_name)}
+
+
+def _create_indexes(conn, *tables):
+    # create_all не добавляет индексы к уже существующим таблицам.
+    # Индексы по колонкам, которых ещё нет, создаст миграция этих колонок
+    for model_table in tables:
+        columns = _columns(conn, model_table.name)
+        for index in model_table.indexes:
+            if all(column.name in columns for column in index.columns):
+                index.create(conn, checkfirst=True)
+
+
+def add_hot_column_indexes(conn):
+    _create_indexes(conn, Balance.__table__, User.__table__)
+
+
+def backfill_daily_totals(conn):
+    if "balance" not in _columns(conn, "balances"):
+        return  # свежая база: итоги с первой записи ведёт add_balance
+    conn.execute(delete(DailyTotal.__table__))
+    totals = defaultdict(lambda: [0, 0])
+    legacy = legacy_balances.c
+    rows = conn.execute(
+        select(legacy.user_id, legacy.timestamp, legacy.balance).execution_options(
+            yield_per=BACKFILL_BATCH_SIZE
+        )
+    )
+    for user_id, timestamp, amount in rows:
+        total = totals[(user_id, get_business_day(timestamp))]
+        total[0] += round(amount * 100)
+        total[1] += 1
+    if totals:
+        conn.execute(
+            insert(DailyTotal.__table__),
+            [
+                {
+                    "user_id": user_id,
+                    "business_day": business_day,
+                    "total_cents": total_cents,
+                    "count": count,
+                }
+                for (user_id, business_day), (total_cents, count) in totals.items()
+            ],
+        )
+
+
+def add_fsm_expiry(conn):
+    if "expires_at" not in _columns(conn, "fsm_states"):
+        conn.execute(text("ALTER TABLE fsm_states ADD COLUMN expires_at INTEGER"))
+    # Регистрации, начатые до появления срока жизни, начнутся заново
+    conn.execute(delete(FsmRecord.__table__).where(FsmRecord.expires_at.is_(None)))
+    _create_indexes(conn, FsmRecord.__table__)
+
+
+def partition_key(conn):
+    # Колонка, по которой партиционирована balances (None - без партиций)
+    return conn.execute(
+        text(
+            "SELECT a.attname FROM pg_partitioned_table pt "
+            "JOIN pg_class c ON c.oid = pt.partrelid "
+            "JOIN pg_attribute a "
+            "ON a.attrelid = pt.partrelid AND a.attnum = pt.partattrs[0] "
+            "WHERE c.relname = 'balances'"
+        )
+    ).scalar()
+
+
+def partition_balances(conn):
+    # Только Postgres: balances становится таблицей с дневными партициями по
+    # timestamp, чтобы срок хранения отрабатывал через DROP партиции.
+    # Свежую базу в текущем формате партиционирует миграция 7
+    if (
+        conn.dialect.name != "postgresql"
+        or is_partitioned(conn)
+        or "business_day" in _columns(conn, "balances")
+    ):
+        return
+    conn.execute(text("ALTER TABLE balances RENAME TO balances_unpartitioned"))
+    conn.execute(
+        text("ALTER INDEX balances_pkey RENAME TO balances_unpartitioned_pkey")
+    )
+    for index in Balance.__table__.indexes:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+    conn.execute(
+        text(
+            "CREATE TABLE balances ("
+            "id INTEGER NOT NULL DEFAULT nextval('balances_id_seq'), "
+            "user_id INTEGER NOT NULL, "
+            "balance DOUBLE PRECISION NOT NULL, "
+            "draft VARCHAR NOT NULL, "
+            "timestamp TIMESTAMP WITHOUT TIME ZONE NOT NULL, "
+            "PRIMARY KEY (id, timestamp)"
+            ") PARTITION BY RANGE (timestamp)"
+        )
+    )
+    conn.execute(text("ALTER SEQUENCE balances_id_seq OWNED BY balances.id"))
+    conn.execute(
+        text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF balances DEFAULT")
+    )
+    # Строки старше срока хранения лягут в default и удалятся пачками
+    today = get_kyiv_timestamp().date()
+    create_partitions(
+        conn,
+        today - timedelta(days=RETENTION_DAYS + 1),
+        today + timedelta(days=PARTITION_DAYS_AHEAD),
+        key="timestamp",
+    )
+    # Строки без времени получают текущее киевское, а не время сервера
+    conn.execute(
+        text(
+            "INSERT INTO balances (id, user_id, balance, draft, timestamp) "
+            "SELECT id, user_id, balance, draft, "
+            f"COALESCE(timestamp, now() AT TIME ZONE '{KYIV_TZ.zone}') "
+            "FROM balances_unpartitioned"
+        )
+    )
+    conn.execute(text("DROP TABLE balances_unpartitioned"))
+    _create_indexes(conn, Balance.__table__)
+
+
+def balances_utc_business_day(conn):
+    # balances.timestamp: киевское время без пояса -> UTC с tzinfo, плюс
+    # business_day. Неоднозначный час перехода на зимнее время считается зимним
+    if "business_day" in _columns(conn, "balances"):
+        return  # свежая база или Postgres, уже пересобранный по business_day
+    if conn.dialect.name == "postgresql":
+        # Тип ключа партиций миграции 4 не меняется, поэтому здесь только
+        # business_day; UTC и партиции по business_day - миграция 7
+        conn.execute(text("ALTER TABLE balances ADD COLUMN business_day DATE"))
+        conn.execute(
+            text(
+                "UPDATE balances SET business_day = "
+                f"(timestamp - INTERVAL '{DAY_CUTOFF.hour} hours')::date"
+            )
+        )
+        return
+    conn.execute(text("ALTER TABLE balances ADD COLUMN business_day DATE"))
+    legacy = legacy_balances.c
+    backfill = (
+        update(legacy_balances)
+        .where(legacy.id == bindparam("row_id"))
+        .values(
+            timestamp=bindparam("utc_timestamp", type_=UtcDateTime()),
+            business_day=bindparam("row_day"),
+        )
+    )
+    for rows in _id_batches(conn, legacy.timestamp):
+        params = []
+        for row_id, local in rows:
+            local = local or get_kyiv_timestamp()
+            params.append(
+                {
+                    "row_id": row_id,
+                    "utc_timestamp": KYIV_TZ.localize(local),
+                    "row_day": get_business_day(local),
+                }
+            )
+        conn.execute(backfill, params)
+    # Окна выбираются по business_day, индексы по timestamp больше не нужны
+    for name in ("ix_balances_timestamp", "ix_balances_user_id_timestamp"):
+        conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    _create_indexes(conn, Balance.__table__)
+
+
+def _id_batches(conn, *columns):
+    # Строки balances пачками по id: [(id, *columns)]
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            select(legacy_balances.c.id, *columns)
+            .where(legacy_balances.c.id > last_id)
+            .order_by(legacy_balances.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def _legacy_parts(draft, balance):
+    # Черновик разбирается как новая запись; если он не по формату
+    # (старый импорт), остаётся сумма из float-колонки без второй части
+    parts = parse_balance(draft or "")
+    if parts is None or parts.amount_cents != round(balance * 100):
+        return round(balance * 100), None, None
+    return parts
+
+
+def balances_integer_cents(conn):
+    # balances.balance (float) -> amount_cents и вторая часть (extra_label,
+    # extra_cents) из черновика; daily_totals.total -> total_cents и extra_cents
+    if "amount_cents" not in _columns(conn, "balances"):
+        for name, type_ in (
+            ("amount_cents", "BIGINT"),
+            ("extra_label", "VARCHAR"),
+            ("extra_cents", "BIGINT"),
+        ):
+            conn.execute(text(f"ALTER TABLE balances ADD COLUMN {name} {type_}"))
+        legacy = legacy_balances.c
+        backfill = (
+            update(Balance.__table__)
+            .where(Balance.id == bindparam("row_id"))
+            .values(
+                amount_cents=bindparam("row_amount"),
+                extra_label=bindparam("row_label"),
+                extra_cents=bindparam("row_extra"),
+            )
+        )
+        for rows in _id_batches(conn, legacy.draft, legacy.balance):
+            params = []
+            for row_id, draft, balance in rows:
+                amount, label, extra = _legacy_parts(draft, balance)
+                params.append(
+                    {
+                        "row_id": row_id,
+                        "row_amount": amount,
+                        "row_label": label,
+                        "row_extra": extra,
+                    }
+                )
+            conn.execute(backfill, params)
+        if conn.dialect.name == "postgresql":
+            conn.execute(
+                text("ALTER TABLE balances ALTER COLUMN amount_cents SET NOT NULL")
+            )
+        conn.execute(text("ALTER TABLE balances DROP COLUMN balance"))
+    if "total_cents" not in _columns(conn, "daily_totals"):
+        for name in ("total_cents", "extra_cents"):
+            conn.execute(
+                text(
+                    "ALTER TABLE daily_totals "
+                    f"ADD COLUMN {name} BIGINT NOT NULL DEFAULT 0"
+                )
+            )
+        conn.execute(
+            text(
+                "UPDATE daily_totals "
+                "SET total_cents = CAST(ROUND(total * 100) AS BIGINT)"
+            )
+        )
+        conn.execute(text("ALTER TABLE daily_totals DROP COLUMN total"))
+    # Суммы КС за дни, сырые строки которых ещё хранятся; по уже удалённым
+    # дням вторая часть не восстановима и остаётся 0
+    extra = (
+        select(func.sum(func.coalesce(Balance.extra_cents, 0)))
+        .where(
+            Balance.user_id == DailyTotal.user_id,
+            Balance.business_day == DailyTotal.business_day,
+        )
+        .scalar_subquery()
+    )
+    conn.execute(
+        update(DailyTotal.__table__)
+        .where(
+            DailyTotal.business_day
+            >= select(func.min(Balance.business_day)).scalar_subquery()
+        )
+        .values(extra_cents=func.coalesce(extra, 0))
+    )
+
+
+def partition_by_business_day(conn):
+    # Postgres: balances пересоздаётся с дневными партициями по business_day,
+    # чтобы партиция была ровно одними рабочими сутками. Киевское время без
+    # пояса (партиции миграции 4) переводится в UTC прямо в INSERT
+    if conn.dialect.name != "postgresql" or partition_key(conn) == "business_day":
+        return
+    old_columns = inspect(conn).get_columns("balances")
+    if is_partitioned(conn):
+        # Освобождаем имена партиций для новой таблицы
+        for name in [*list_partitions(conn).values(), DEFAULT_PARTITION]:
+            conn.execute(text(f"ALTER TABLE IF EXISTS {name} RENAME TO {name}_old"))
+    conn.execute(text("ALTER TABLE balances RENAME TO balances_old"))
+    conn.execute(text("ALTER INDEX balances_pkey RENAME TO balances_old_pkey"))
+    conn.execute(
+        text(
+            "CREATE TABLE balances "
+            "(LIKE balances_old INCLUDING DEFAULTS, PRIMARY KEY (id, business_day))"
+            " PARTITION BY RANGE (business_day)"
+        )
+    )
+    names, values = [], []
+    for old_column in old_columns:
+        name = old_column["name"]
+        names.append(name)
+        if name == "timestamp" and not old_column["type"].timezone:
+            conn.execute(
+                text(
+                    "ALTER TABLE balances "
+                    "ALTER COLUMN timestamp TYPE TIMESTAMP WITH TIME ZONE"
+                )
+            )
+            values.append(f"timestamp AT TIME ZONE '{KYIV_TZ.zone}'")
+        else:
+            values.append(name)
+    conn.execute(text("ALTER SEQUENCE balances_id_seq OWNED BY balances.id"))
+    conn.execute(
+        text(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF balances DEFAULT")
+    )
+    # Строки старше срока хранения лягут в default и удалятся пачками
+    today = get_business_day(get_kyiv_timestamp())
+    create_partitions(
+        conn,
+        today - timedelta(days=RETENTION_DAYS + 1),
+        today + timedelta(days=PARTITION_DAYS_AHEAD),
+    )
+    conn.execute(
+        text(
+            f"INSERT INTO balances ({', '.join(names)}) "
+            f"SELECT {', '.join(values)} FROM balances_old"
+        )
+    )
+    # Старые индексы и партиции удаляются вместе с таблицей
+    conn.execute(text("DROP TABLE balances_old"))
+    _create_indexes(conn, Balance.__table__)
+
+
+# Миграции применяются по порядку и должны быть идемпотентными:
+# на свежей базе create_all уже создал всё, что описано в моделях.
+MIGRATIONS = [
+    (1, "balances and users hot column indexes", add_hot_column_indexes),
+    (2, "daily_totals rollup backfill", backfill_daily_totals),
+    (3, "fsm_states expiry", add_fsm_expiry),
+    (4, "balances daily partitions (Postgres)", partition_balances),
+    (5, "balances UTC timestamps and business_day", balances_utc_business_day),
+    (6, "balances and daily_totals integer cents", balances_integer_cents),
+    (7, "balances partitions by business_day (Postgres)", partition_by_business_day),
+]
+
+
+def current_version(conn):
+    return conn.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def migrate(conn):
+    Base.metadata.create_all(conn)
+    metadata.create_all(conn)
+    version = current_version(conn)
+    for number, name, apply in MIGRATIONS:
+        if number <= version:
+            continue
+        logging.info(f"Applying migration {number}: {name}")
+        apply(conn)
+        conn.execute(insert(schema_version).values(version=number, name=name))
+    return current_version(conn)
+
+
+async def run_migrations(bind=None):
+    # Миграции написаны на синхронном Connection и выполняются через run_sync
+    async with (bind or app.engine).begin() as conn:
+        return await conn.run_sync(migrate)
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    async def migrate_once():
+        try:
+            return await run_migrations()
+        finally:
+            await app.close()
+
+    print(f"Schema version: {asyncio.run(migrate_once())}")
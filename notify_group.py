@@ -1,65 +1,86 @@
+import asyncio
 import os
-from aiogram import Bot
-from sqlalchemy.orm import sessionmaker
-from database import engine, User, Balance
 from dotenv import load_dotenv
+from sender import GROUP_NOTIFICATION, outbound
 
 load_dotenv()
 
-API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
 CHAT_ID = os.getenv("CHAT_ID")
 
-bot = Bot(token=API_TOKEN)
 
-Session = sessionmaker(bind=engine)
-session = Session()
+def format_cents(cents):
+    return f"{cents // 100},{cents % 100:02d}$"
 
 
-def format_draft(draft):
-    parts = draft.split("+")
-    formatted_parts = []
-    for part in parts:
-        part = part.strip()
-        if "кс" in part.lower():
-            part = part.replace("кс", "КС").replace(".", ",")
-            formatted_parts.append(part + "$")
-        else:
-            part = part.replace(".", ",")
-            formatted_parts.append(part + "$")
-    return " + ".join(formatted_parts)
+def format_balance(balance):
+    # balance - запись Balance или routing.BalanceParts: части уже разобраны
+    text = format_cents(balance.amount_cents)
+    if balance.extra_cents is not None:
+        text += f" + {balance.extra_label} {format_cents(balance.extra_cents)}"
+    return text
+
+
+def render_notification(user, balance):
+    formatted_draft = format_balance(balance)
+    return (
+        f"✅ <b>Смена завершена!</b>\n"
+        f"<b>- Имя:</b> {user.nickname}\n"
+        f"<b>- Смена:</b> {user.shift} ({user.site})\n"
+        f"<b>- Администратор:</b> {user.admin_nickname}\n"
+        f"<b>- Баланс:</b> {formatted_draft}"
+    )
 
 
-async def notify_group(user_id):
+async def notify_group(user, balance):
+    # user и balance уже есть у вызывающего кода, в базу здесь не ходим
     try:
-        user = session.query(User).filter_by(id=user_id).first()
-        if user:
-            balance = (
-                session.query(Balance)
-                .filter_by(user_id=user_id)
-                .order_by(Balance.id.desc())
-                .first()
-            )
-            if balance:
-                formatted_draft = format_draft(balance.draft)
-                message = (
-                    f"✅ <b>Смена завершена!</b>\n"
-                    f"<b>- Имя:</b> {user.nickname}\n"
-                    f"<b>- Смена:</b> {user.shift} ({user.site})\n"
-                    f"<b>- Администратор:</b> {user.admin_nickname}\n"
-                    f"<b>- Баланс:</b> {formatted_draft}"
-                )
-                await bot.send_message(chat_id=CHAT_ID, text=message, parse_mode="HTML")
-                print("Notification sent successfully.")
-            else:
-                print("No balance found for the user.")
-        else:
-            print("User not found.")
+        message = render_notification(user, balance)
+        await outbound.send_message(
+            CHAT_ID, message, priority=GROUP_NOTIFICATION, parse_mode="HTML"
+        )
+        print("Notification sent successfully.")
     except Exception as e:
         print(f"Failed to send notification: {e}")
 
 
+# Ссылки на фоновые уведомления, чтобы задачи не собрал GC до завершения
+pending_notifications = set()
+
+
+def schedule_notification(user, balance):
+    task = asyncio.create_task(notify_group(user, balance))
+    pending_notifications.add(task)
+    task.add_done_callback(pending_notifications.discard)
+    return task
+
+
+async def drain_notifications():
+    if pending_notifications:
+        await asyncio.gather(*pending_notifications, return_exceptions=True)
+
+
 if __name__ == "__main__":
-    import asyncio
+    from sqlalchemy import select
+
+    from app import app
+    from database import Balance, User
+
+    async def notify_last_balance(user_id):
+        outbound.start(app.bot)
+        async with app.session() as session:
+            user = await session.get(User, user_id)
+            balance = await session.scalar(
+                select(Balance)
+                .filter_by(user_id=user_id)
+                .order_by(Balance.id.desc())
+                .limit(1)
+            )
+        if user and balance:
+            await notify_group(user, balance)
+        else:
+            print("User or balance not found.")
+        await outbound.stop()
+        await app.close()
 
     user_id = 1  # Replace with the actual user ID for testing
-    asyncio.run(notify_group(user_id))
+    asyncio.run(notify_last_balance(user_id))
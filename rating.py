@@ -0,0 +1,354 @@
+import asyncio
+import os
+from array import array
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
+from itertools import accumulate, repeat
+from time import monotonic
+
+from sqlalchemy import and_, func, select
+
+from database import (KYIV_TZ, DailyTotal, User, get_business_day,
+                      get_kyiv_timestamp)
+
+
+def get_kyiv_time():
+    return datetime.now(KYIV_TZ)
+
+
+def get_today_kyiv():
+    return get_kyiv_time().date()
+
+
+def window(days, today=None):
+    # Рабочие сутки (today - days) ... (today - 1), т.е. с 09:00 до 09:00 сегодня
+    today = today or get_today_kyiv()
+    return today - timedelta(days=days), today - timedelta(days=1)
+
+
+def daily_window(today=None):
+    return window(1, today)
+
+
+def weekly_window(today=None):
+    return window(7, today)
+
+
+def range_window(start_day, end_day):
+    # /rating <с> <по>: с 09:00 start_day до 09:00 end_day, т.е. рабочие сутки
+    # start_day ... end_day - 1; window(days) == range_window(today - days, today)
+    return start_day, end_day - timedelta(days=1)
+
+
+RATING_DAY_FORMATS = ["%Y-%m-%d", "%d.%m.%Y", "%d.%m"]
+
+
+def parse_rating_day(text, today=None):
+    for day_format in RATING_DAY_FORMATS:
+        try:
+            parsed = datetime.strptime(text, day_format).date()
+        except ValueError:
+            continue
+        if day_format == "%d.%m":
+            parsed = parsed.replace(year=(today or get_today_kyiv()).year)
+        return parsed
+    return None
+
+
+def operator_totals_query(first_day, last_day):
+    # Один сгруппированный запрос по итогам рабочих суток: одна строка
+    # на оператора в день вместо всех его балансов за окно.
+    # Условие окна стоит в ON, чтобы пользователи без балансов попадали с нулём.
+    total = func.coalesce(func.sum(DailyTotal.total_cents), 0).label("total_cents")
+    in_window = and_(
+        DailyTotal.user_id == User.id,
+        DailyTotal.business_day >= first_day,
+        DailyTotal.business_day <= last_day,
+    )
+    return (
+        select(
+            User.id,
+            User.site,
+            User.nickname,
+            User.admin_nickname,
+            User.top_admin,
+            total,
+        )
+        .outerjoin(DailyTotal, in_window)
+        .group_by(User.id)
+    )
+
+
+# total_cents - целые центы: суммы рейтингов складываются точно
+OperatorTotal = namedtuple(
+    "OperatorTotal", "id site nickname admin_nickname top_admin total_cents"
+)
+
+
+async def load_operator_totals(session, first_day, last_day):
+    result = await session.execute(operator_totals_query(first_day, last_day))
+    return [OperatorTotal(*row) for row in result]
+
+
+# Периоды до месяца (в т.ч. ежедневный и еженедельный рейтинг) считает
+# operator_totals_query: он читает только сутки окна
+RANGE_QUERY_DAYS = 31
+# Индекс хранит столько последних закрытых суток; более старые периоды -
+# тоже запросом
+INDEX_DAYS = int(os.getenv("RATING_INDEX_DAYS", "400"))
+# Раз в INDEX_TTL перечитываются последние RECHECK_DAYS суток:
+# туда попадают правки из других воркеров (/rbalance)
+INDEX_TTL = 15 * 60
+RECHECK_DAYS = 2
+INDEX_BATCH_ROWS = 10000
+
+
+def _extend_sums(sums, first_day, new_first_day, reload_from, last_day, rows):
+    # Новая копия sums: сутки с reload_from пересчитаны из rows,
+    # сутки до new_first_day отброшены. Выполняется в отдельном потоке
+    keep = (reload_from - first_day).days + 1
+    days = (last_day - reload_from).days + 1
+    shift = (new_first_day - first_day).days
+    daily = defaultdict(lambda: [0] * days)
+    for user_id, business_day, total_cents in rows:
+        daily[user_id][(business_day - reload_from).days] += total_cents
+    extended = {}
+    for user_id in sums.keys() | daily.keys():
+        user_sums = sums.get(user_id)
+        if user_sums is None:
+            user_sums = array("q", bytes(8 * keep))
+        else:
+            user_sums = user_sums[:keep]
+        user_days = daily.get(user_id)
+        if user_days is None:
+            user_sums.extend(repeat(user_sums[-1], days))
+        else:
+            user_sums.extend(accumulate(user_days, initial=user_sums[-1]))
+            del user_sums[keep]  # initial уже последний элемент префикса
+        # Для разностей база не важна, поэтому старые сутки просто срезаются
+        del user_sums[:shift]
+        extended[user_id] = user_sums
+    return extended
+
+
+class PrefixSumIndex:
+    """Накопленные суммы операторов по последним INDEX_DAYS закрытым суткам.
+
+    sums[user_id][i] - сумма в центах за сутки first_day ... first_day + i - 1,
+    поэтому итог оператора за любой диапазон - разность двух элементов, O(1)
+    при любой длине диапазона. Индекс строится один раз, дальше к нему
+    дописываются новые закрытые сутки и перечитываются изменённые.
+    """
+
+    def __init__(self):
+        self.first_day = None
+        self.last_day = None
+        self.sums = {}  # user_id -> array("q") накопленных центов
+        self.checked_at = None
+        self.stale_from = None  # с этих суток итоги надо перечитать
+        self.lock = asyncio.Lock()
+
+    def invalidate(self, day=None):
+        # Изменились итоги закрытых суток day (None - неизвестно каких):
+        # при следующем обращении они и следующие сутки перечитываются
+        if self.first_day is None:
+            return
+        day = self.first_day if day is None else max(day, self.first_day)
+        if self.stale_from is None or day < self.stale_from:
+            self.stale_from = day
+
+    def covers(self, first_day, last_day):
+        # Период попадает в индекс, построенный к закрытым суткам last_day
+        return first_day > last_day - timedelta(days=INDEX_DAYS)
+
+    async def refresh(self, session, last_day):
+        async with self.lock:
+            new_first_day = last_day - timedelta(days=INDEX_DAYS - 1)
+            if self.first_day is None:
+                first_day, reload_from = new_first_day, new_first_day
+            else:
+                first_day = self.first_day
+                reload_from = self.last_day + timedelta(days=1)
+                if self.stale_from is not None:
+                    reload_from = min(reload_from, self.stale_from)
+                if monotonic() - self.checked_at >= INDEX_TTL:
+                    recheck = self.last_day - timedelta(days=RECHECK_DAYS - 1)
+                    reload_from = min(reload_from, recheck)
+                reload_from = max(reload_from, first_day)
+                if reload_from > last_day:
+                    return
+            rows = []
+            result = await session.stream(
+                select(
+                    DailyTotal.user_id, DailyTotal.business_day, DailyTotal.total_cents
+                ).where(
+                    DailyTotal.business_day >= max(reload_from, new_first_day),
+                    DailyTotal.business_day <= last_day,
+                )
+            )
+            async for partition in result.partitions(INDEX_BATCH_ROWS):
+                rows.extend(partition)
+            # Разбор строк и накопленные суммы - вне событийного цикла
+            self.sums = await asyncio.to_thread(
+                _extend_sums,
+                self.sums,
+                first_day,
+                new_first_day,
+                reload_from,
+                last_day,
+                rows,
+            )
+            self.first_day = new_first_day
+            self.last_day = last_day
+            self.stale_from = None
+            self.checked_at = monotonic()
+
+    def total_cents(self, user_id, first_day, last_day):
+        user_sums = self.sums.get(user_id)
+        if user_sums is None:
+            return 0
+        days = len(user_sums) - 1
+        start = min(max((first_day - self.first_day).days, 0), days)
+        end = min(max((last_day - self.first_day).days + 1, 0), days)
+        return user_sums[end] - user_sums[start] if end > start else 0
+
+
+rating_index = PrefixSumIndex()
+
+
+async def load_range_totals(session, first_day, last_day):
+    # Итоги всех операторов за рабочие сутки first_day ... last_day включительно
+    closed_day = get_business_day(get_kyiv_timestamp()) - timedelta(days=1)
+    if (last_day - first_day).days < RANGE_QUERY_DAYS or not rating_index.covers(
+        first_day, closed_day
+    ):
+        return await load_operator_totals(session, first_day, last_day)
+    await rating_index.refresh(session, closed_day)
+    open_cents = {}
+    if last_day > closed_day:
+        # Текущие сутки ещё пополняются - их итоги читаем из daily_totals
+        open_day = max(first_day, closed_day + timedelta(days=1))
+        open_cents = dict(
+            (
+                await session.execute(
+                    select(DailyTotal.user_id, func.sum(DailyTotal.total_cents))
+                    .where(
+                        DailyTotal.business_day >= open_day,
+                        DailyTotal.business_day <= last_day,
+                    )
+                    .group_by(DailyTotal.user_id)
+                )
+            ).all()
+        )
+    users = await session.execute(
+        select(User.id, User.site, User.nickname, User.admin_nickname, User.top_admin)
+    )
+    return [
+        OperatorTotal(
+            *user,
+            rating_index.total_cents(user.id, first_day, last_day)
+            + open_cents.get(user.id, 0),
+        )
+        for user in users
+    ]
+
+
+class RatingSnapshot:
+    """Итоги операторов за окно, из которых в памяти собираются все три рейтинга.
+
+    Суммы складываются в центах, в рейтинги отдаются доллары.
+    """
+
+    def __init__(self, first_day, last_day, rows):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.rows = rows
+        self.created_at = monotonic()
+
+    @classmethod
+    async def load(cls, session, first_day, last_day):
+        rows = await load_range_totals(session, first_day, last_day)
+        return cls(first_day, last_day, rows)
+
+    def operators(self, limit=None):
+        rows = sorted(self.rows, key=lambda row: (-row.total_cents, row.id))
+        return [
+            (
+                row.site,
+                row.nickname,
+                row.total_cents / 100,
+                row.admin_nickname,
+                row.top_admin,
+            )
+            for row in rows[:limit]
+        ]
+
+    def admins(self):
+        admins = {}
+        for row in self.rows:
+            site, total, top_admin = admins.get(row.admin_nickname, (None, 0, None))
+            admins[row.admin_nickname] = (
+                _max(site, row.site),
+                total + row.total_cents,
+                _max(top_admin, row.top_admin),
+            )
+        ranked = sorted(admins.items(), key=lambda item: (-item[1][1], item[0]))
+        return [
+            (site, admin_nickname, total / 100, top_admin)
+            for admin_nickname, (site, total, top_admin) in ranked
+        ]
+
+    def top_admins(self):
+        top_admins = defaultdict(int)
+        for row in self.rows:
+            if row.top_admin is not None:
+                top_admins[row.top_admin] += row.total_cents
+        ranked = sorted(top_admins.items(), key=lambda item: (-item[1], item[0]))
+        return [(top_admin, total / 100) for top_admin, total in ranked]
+
+
+RATING_KINDS = {
+    "operators": lambda snapshot: snapshot.operators(limit=10),
+    "admins": lambda snapshot: snapshot.admins(),
+    "top": lambda snapshot: snapshot.top_admins(),
+}
+
+
+async def range_rating(session, start_day, end_day, kind="operators"):
+    # Рейтинг с 09:00 start_day до 09:00 end_day без кэша снимков:
+    # диапазон может захватывать текущие сутки
+    first_day, last_day = range_window(start_day, end_day)
+    snapshot = await RatingSnapshot.load(session, first_day, last_day)
+    return RATING_KINDS[kind](snapshot)
+
+
+def _max(current, value):
+    if current is None:
+        return value
+    if value is None:
+        return current
+    return max(current, value)
+
+
+# Снимок живёт в пределах одной публикации:
+# 09:15-09:17:40 ежедневно и 09:02-09:10 по понедельникам.
+# Новые балансы в закрытые рабочие сутки не попадают, поэтому снимок окна не устаревает.
+SNAPSHOT_TTL = 15 * 60
+
+_snapshots = {}
+
+
+async def get_snapshot(session, first_day, last_day):
+    snapshot = _snapshots.get((first_day, last_day))
+    if snapshot is None or monotonic() - snapshot.created_at > SNAPSHOT_TTL:
+        snapshot = await RatingSnapshot.load(session, first_day, last_day)
+        _snapshots.clear()
+        _snapshots[(first_day, last_day)] = snapshot
+    return snapshot
+
+
+def invalidate_ratings(day=None):
+    # Изменились итоги закрытых суток day (/rbalance) или неизвестно каких
+    # (импорт балансов, сверка архива): сбрасываем снимки и индекс с этих суток
+    rating_index.invalidate(day)
+    _snapshots.clear()
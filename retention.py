@@ -0,0 +1,191 @@
+import asyncio
+import os
+import time as timer
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, text
+
+from app import app
+from database import Balance, DailyTotal, get_business_day, get_kyiv_timestamp
+
+RETENTION_DAYS = int(os.getenv("BALANCE_RETENTION_DAYS", "9"))
+PURGE_BATCH_SIZE = int(os.getenv("PURGE_BATCH_SIZE", "5000"))
+# Партиции на несколько дней вперёд, чтобы вставки не попадали в default
+PARTITION_DAYS_AHEAD = 7
+PARTITION_PREFIX = "balances_p"
+DEFAULT_PARTITION = "balances_default"
+
+
+def partition_name(day):
+    return f"{PARTITION_PREFIX}{day:%Y%m%d}"
+
+
+def is_partitioned(conn):
+    if conn.dialect.name != "postgresql":
+        return False
+    return (
+        conn.execute(
+            text(
+                "SELECT 1 FROM pg_partitioned_table pt "
+                "JOIN pg_class c ON c.oid = pt.partrelid "
+                "WHERE c.relname = 'balances'"
+            )
+        ).first()
+        is not None
+    )
+
+
+def list_partitions(conn):
+    # {день: имя партиции} для дневных партиций balances
+    rows = conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = 'balances'"
+        )
+    )
+    return {
+        datetime.strptime(name[len(PARTITION_PREFIX):], "%Y%m%d").date(): name
+        for (name,) in rows
+        if name.startswith(PARTITION_PREFIX)
+    }
+
+
+def create_partitions(conn, first_day, last_day, key="business_day"):
+    # key - колонка партиционирования (timestamp у таблицы миграции 4)
+    existing = list_partitions(conn)
+    day = first_day
+    while day <= last_day:
+        next_day = day + timedelta(days=1)
+        # Если строки этого дня уже легли в default, партицию создать нельзя -
+        # они останутся в default и удалятся пачками
+        in_default = conn.execute(
+            text(
+                f"SELECT 1 FROM {DEFAULT_PARTITION} "
+                f"WHERE {key} >= :day AND {key} < :next_day LIMIT 1"
+            ),
+            {"day": day, "next_day": next_day},
+        ).first()
+        if day not in existing and in_default is None:
+            conn.execute(
+                text(
+                    f"CREATE TABLE {partition_name(day)} PARTITION OF balances "
+                    f"FOR VALUES FROM ('{day}') TO ('{next_day}')"
+                )
+            )
+        day = next_day
+
+
+def ensure_partitions(conn):
+    if is_partitioned(conn):
+        today = get_business_day(get_kyiv_timestamp())
+        create_partitions(conn, today, today + timedelta(days=PARTITION_DAYS_AHEAD))
+
+
+def drop_expired_partitions(conn, cutoff):
+    # Партиция - одни рабочие сутки; удаляются все до cutoff. Строки не
+    # считаются: число удалённых берётся из daily_totals, уже сверенных
+    # archive_expired_days
+    days = []
+    for day, name in sorted(list_partitions(conn).items()):
+        if day >= cutoff:
+            break
+        conn.execute(text(f"DROP TABLE {name}"))
+        days.append(day)
+    if not days:
+        return 0
+    return conn.execute(
+        select(func.coalesce(func.sum(DailyTotal.count), 0)).where(
+            DailyTotal.business_day.in_(days)
+        )
+    ).scalar()
+
+
+async def purge_in_batches(cutoff, batch_size=PURGE_BATCH_SIZE):
+    # Без партиций (SQLite) и для остатков в default: короткие транзакции
+    # по batch_size строк, между ними хендлеры успевают записать балансы
+    removed = 0
+    while True:
+        expired = (
+            select(Balance.id)
+            .where(Balance.business_day < cutoff)
+            .limit(batch_size)
+            .scalar_subquery()
+        )
+        async with app.engine.begin() as conn:
+            result = await conn.execute(delete(Balance).where(Balance.id.in_(expired)))
+        removed += result.rowcount
+        if result.rowcount < batch_size:
+            return removed
+        await asyncio.sleep(0)
+
+
+def archive_expired_days(conn, cutoff):
+    # daily_totals - долгосрочный архив. Итоги пишутся вместе с балансами,
+    # поэтому перед удалением сырых строк досчитываются только операторо-дни
+    # до cutoff, которых в daily_totals нет (строки старше самих итогов).
+    # Возвращает число восстановленных операторо-дней
+    archived = (
+        select(DailyTotal.user_id)
+        .where(
+            DailyTotal.user_id == Balance.user_id,
+            DailyTotal.business_day == Balance.business_day,
+        )
+        .exists()
+    )
+    missing = conn.execute(
+        select(
+            Balance.user_id,
+            Balance.business_day,
+            func.sum(Balance.amount_cents),
+            func.sum(func.coalesce(Balance.extra_cents, 0)),
+            func.count(),
+        )
+        .where(Balance.business_day < cutoff, ~archived)
+        .group_by(Balance.user_id, Balance.business_day)
+    ).all()
+    if missing:
+        conn.execute(
+            insert(DailyTotal),
+            [
+                {
+                    "user_id": user_id,
+                    "business_day": business_day,
+                    "total_cents": total_cents,
+                    "extra_cents": extra_cents,
+                    "count": count,
+                }
+                for user_id, business_day, total_cents, extra_cents, count in missing
+            ],
+        )
+    return len(missing)
+
+
+async def ensure_balance_partitions():
+    async with app.engine.begin() as conn:
+        await conn.run_sync(ensure_partitions)
+
+
+def retention_cutoff(now=None):
+    # Удаляются только целые рабочие сутки: граница - первые сохраняемые сутки
+    expired = (now or get_kyiv_timestamp()) - timedelta(days=RETENTION_DAYS)
+    return get_business_day(expired)
+
+
+async def purge_old_balances(now=None):
+    started = timer.monotonic()
+    cutoff = retention_cutoff(now)
+    removed = 0
+    async with app.engine.begin() as conn:
+        restored = await conn.run_sync(archive_expired_days, cutoff)
+    async with app.engine.begin() as conn:
+        if await conn.run_sync(is_partitioned):
+            removed += await conn.run_sync(drop_expired_partitions, cutoff)
+            await conn.run_sync(ensure_partitions)
+    removed += await purge_in_batches(cutoff)
+    return {
+        "removed": removed,
+        "reconciled": restored,
+        "duration": timer.monotonic() - started,
+    }
@@ -0,0 +1,77 @@
+import inspect
+import re
+from collections import namedtuple
+
+# Баланс в формате 112,50 или 20,50 + КС 100,43: основная сумма и
+# необязательная вторая часть с подписью (подпись начинается с буквы)
+BALANCE_PATTERN = re.compile(
+    r"^(?P<amount>\d+(?:[.,]\d{1,2})?)"
+    r"(?:\s*\+\s*(?P<label>[^\W\d_]\w*?)\s*(?P<extra>\d+(?:[.,]\d{1,2})?))?$",
+    re.IGNORECASE,
+)
+KS_LABEL = "КС"
+KS_ALIASES = {"КС", "KC"}  # кириллица и латиница выглядят одинаково
+
+# Части баланса в целых центах; в рейтинг идёт только amount_cents
+BalanceParts = namedtuple("BalanceParts", "amount_cents extra_label extra_cents")
+
+
+def to_cents(text):
+    whole, _, fraction = text.replace(",", ".").partition(".")
+    return int(whole) * 100 + int(fraction.ljust(2, "0"))
+
+
+def parse_balance(text):
+    # "20,50 + кс 100,43" -> BalanceParts(2050, "КС", 10043); None - не баланс
+    match = BALANCE_PATTERN.match(text.strip())
+    if match is None:
+        return None
+    label, extra = match["label"], match["extra"]
+    if label is not None and label.upper() in KS_ALIASES:
+        label = KS_LABEL
+    return BalanceParts(
+        to_cents(match["amount"]), label, to_cents(extra) if extra else None
+    )
+
+
+class Route:
+    __slots__ = ("handler", "registration_step", "wants_session", "wants_state")
+
+    def __init__(self, handler, registration_step):
+        self.handler = handler
+        self.registration_step = registration_step
+        parameters = inspect.signature(handler).parameters
+        self.wants_session = "session" in parameters
+        self.wants_state = "state" in parameters
+
+    async def __call__(self, message, session, state):
+        kwargs = {}
+        if self.wants_session:
+            kwargs["session"] = session
+        if self.wants_state:
+            kwargs["state"] = state
+        return await self.handler(message, **kwargs)
+
+
+class TextRouter:
+    """Точные тексты кнопок -> хендлер, одним поиском в словаре.
+
+    registration_step=True - кнопка шага регистрации: она срабатывает,
+    только если регистрация уже начата, иначе текст считается ником.
+    """
+
+    def __init__(self):
+        self.routes = {}
+
+    def route(self, *texts, registration_step=False):
+        def register(handler):
+            for text in texts:
+                if text in self.routes:
+                    raise ValueError(f"Route for {text!r} is already registered")
+                self.routes[text] = Route(handler, registration_step)
+            return handler
+
+        return register
+
+    def resolve(self, text):
+        return self.routes.get(text)
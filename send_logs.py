@@ -1,51 +1,247 @@
+"""Отправка важных строк bot.log владельцу (MY_ID) сжатыми документами.
+
+Лог читается построчно с сохранённого смещения (log_ship.json), поэтому
+память не зависит от размера файла, а строки, дописанные во время чтения,
+уйдут в следующий раз. После ротации сначала дочитываются архивы
+bot.log.N.gz, начиная с того, который читался; при первом запуске (нет
+log_ship.json) отправляются все имеющиеся архивы. Смещение сохраняется
+только после успешной отправки. Чтение и сжатие идут в отдельном потоке,
+чтобы не задерживать апдейты бота.
+Запуск вручную: python send_logs.py
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import logging
 import os
+import re
+import tempfile
 from datetime import datetime
-from aiogram import Bot
+
 from dotenv import load_dotenv
-import logging
+
+from log_setup import LOG_BACKUPS, LOG_DIR, LOG_SUFFIX, log_path
+from sender import REPORT, outbound
 
 load_dotenv()
 
-API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
-MY_ID = os.getenv("MY_ID")
+# Без MY_ID логи некому отправлять - отправка выключена
+MY_ID = int(os.getenv("MY_ID")) if os.getenv("MY_ID") else None
 
-bot = Bot(token=API_TOKEN)
+LOG_FILE_PATH = log_path("bot")
+STATE_PATH = os.path.join(LOG_DIR, f"log_ship{LOG_SUFFIX}.json")
+LOG_SHIP_MINUTES = int(os.getenv("LOG_SHIP_MINUTES", "60"))
+# Несжатый объём одного документа; больше - несколько документов
+MAX_BATCH_BYTES = int(os.getenv("LOG_SHIP_MAX_BYTES", str(5 * 1024 * 1024)))
+# По началу файла узнаём его среди архивов после ротации
+HEAD_BYTES = 256
 
-LOG_FILE_PATH = "bot.log"  # Log file inside the project directory
+RECORD_START = re.compile(rb"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}")
+IMPORTANT = re.compile(
+    rb" - (?:WARNING|ERROR|CRITICAL) - |" + re.escape("Бот завершает работу".encode())
+)
 
 
-def filter_important_logs(logs):
-    important_logs = []
-    for line in logs.splitlines():
-        if "INFO - Бот завершает работу" in line or "SQL query execution time" in line:
-            important_logs.append(line)
-    return "\n".join(important_logs)
+def is_important(line):
+    return IMPORTANT.search(line) is not None
 
 
 def log_restart():
     logging.warning("Bot is restarting...")
 
 
-async def send_logs():
+def file_head(path, size=HEAD_BYTES):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rb") as f:
+        head = f.read(size)
+    return hashlib.sha1(head).hexdigest(), len(head)
+
+
+def load_state():
     try:
-        if os.path.exists(LOG_FILE_PATH):
-            with open(LOG_FILE_PATH, "r") as log_file:
-                logs = log_file.read()
+        with open(STATE_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {"inode": None, "offset": 0, "head": None, "head_size": 0}
+
 
-            important_logs = filter_important_logs(logs)
+def save_state(state):
+    tmp_path = STATE_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, STATE_PATH)
 
-            # Clear the log file after sending
-            with open(LOG_FILE_PATH, "w") as log_file:
-                log_file.write("")
 
-            print("Logs sent and cleared successfully.")
-        else:
-            print(f"Log file {LOG_FILE_PATH} does not exist.")
+def pending_sources(state):
+    # [(путь, смещение, это текущий файл)] в порядке записи
+    try:
+        stat = os.stat(LOG_FILE_PATH)
+    except FileNotFoundError:
+        stat = None
+    same_file = (
+        stat is not None
+        and stat.st_ino == state["inode"]
+        and stat.st_size >= state["offset"]
+    )
+    sources = []
+    if state["inode"] is None:
+        # Первый запуск: сначала все архивы, от старых к новым
+        archives = []
+        for i in range(1, LOG_BACKUPS + 1):
+            path = f"{LOG_FILE_PATH}.{i}.gz"
+            if not os.path.exists(path):
+                break
+            archives.append((path, 0, False))
+        sources += reversed(archives)
+    elif not same_file:
+        # Файл ротирован: ищем среди архивов тот, который читали
+        for i in range(1, LOG_BACKUPS + 1):
+            path = f"{LOG_FILE_PATH}.{i}.gz"
+            if not os.path.exists(path):
+                break
+            if file_head(path, state["head_size"])[0] == state["head"]:
+                sources.append((path, state["offset"], False))
+                sources += [
+                    (f"{LOG_FILE_PATH}.{j}.gz", 0, False) for j in range(i - 1, 0, -1)
+                ]
+                break
+    if stat is not None:
+        sources.append((LOG_FILE_PATH, state["offset"] if same_file else 0, True))
+    return sources
+
+
+class Batch:
+    """Сжатый документ во временном файле: память не растёт с размером."""
+
+    def __init__(self):
+        self.file = tempfile.NamedTemporaryFile(suffix=".log.gz", delete=False)
+        self.writer = gzip.GzipFile(fileobj=self.file, mode="wb")
+        self.lines = 0
+        self.size = 0
+
+    def add(self, line):
+        self.writer.write(line)
+        self.lines += 1
+        self.size += len(line)
+
+    def close(self):
+        self.writer.close()
+        self.file.close()
+
+    async def upload(self):
+        from aiogram.types import FSInputFile
+
+        self.close()
+        try:
+            name = f"bot{LOG_SUFFIX}-{datetime.now():%Y-%m-%d_%H-%M}.log.gz"
+            await outbound.send_document(
+                MY_ID,
+                FSInputFile(self.file.name, filename=name),
+                priority=REPORT,
+                caption=f"Важные строки лога: {self.lines}",
+            )
+        finally:
+            os.remove(self.file.name)
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+
+def read_batch(path, offset, is_current, important):
+    # Важные строки path с offset, пока документ не наберёт MAX_BATCH_BYTES.
+    # Выполняется в потоке; -> (Batch или None, смещение, important, дочитан)
+    opener = gzip.open if path.endswith(".gz") else open
+    batch = None
+    try:
+        with opener(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if is_current and not line.endswith(b"\n"):
+                    break  # строка ещё дописывается
+                offset += len(line)
+                if RECORD_START.match(line):
+                    important = is_important(line)
+                if important:
+                    # Строки без времени - продолжение записи (traceback)
+                    batch = batch or Batch()
+                    batch.add(line)
+                    if batch.size >= MAX_BATCH_BYTES:
+                        batch.close()
+                        return batch, offset, important, False
+        if batch is not None:
+            batch.close()
+    except BaseException:
+        if batch is not None:
+            batch.discard()
+        raise
+    return batch, offset, important, True
+
+
+async def ship_file(path, offset, is_current, on_uploaded):
+    # Отправляет важные строки path начиная с offset; -> (строк, новое смещение)
+    shipped = 0
+    important = False
+    while True:
+        batch, offset, important, done = await asyncio.to_thread(
+            read_batch, path, offset, is_current, important
+        )
+        if batch is not None:
+            await batch.upload()
+            shipped += batch.lines
+            on_uploaded(offset)
+        if done:
+            return shipped, offset
+
+
+async def send_logs():
+    # Возвращает число отправленных строк
+    if MY_ID is None:
+        return 0
+    state = load_state()
+
+    def save_offset(offset):
+        state["offset"] = offset
+        save_state(state)
+
+    shipped = 0
+    for path, offset, is_current in await asyncio.to_thread(pending_sources, state):
+        if not is_current:
+            # Архивы дочитываются целиком; при сбое их найдут снова по началу
+            shipped += (await ship_file(path, offset, False, lambda offset: None))[0]
+            continue
+        inode = os.stat(path).st_ino
+        if state["inode"] != inode:
+            state.update(inode=inode, offset=0, head=None, head_size=0)
+        lines, offset = await ship_file(path, offset, True, save_offset)
+        shipped += lines
+        if state["head_size"] < HEAD_BYTES:
+            state["head"], state["head_size"] = file_head(path)
+        save_offset(offset)
+    return shipped
+
+
+async def ship_logs():
+    # Задача планировщика: ошибки отправки не должны ронять бота
+    try:
+        shipped = await send_logs()
+        if shipped:
+            logging.info(f"Log shipper sent {shipped} lines")
     except Exception as e:
-        print(f"Failed to send logs: {e}")
+        logging.error(f"Log shipper failed: {e}")
 
 
 if __name__ == "__main__":
-    import asyncio
+    from app import app
+
+    async def send_once():
+        outbound.start(app.bot)
+        try:
+            print(f"Sent {await send_logs()} lines")
+        finally:
+            await outbound.stop()
+            await app.close()
 
-    asyncio.run(send_logs())
+    asyncio.run(send_once())
@@ -0,0 +1,248 @@
+import asyncio
+import itertools
+import logging
+import os
+from time import monotonic
+
+# Приоритеты исходящих сообщений: меньше - раньше
+USER_REPLY = 0
+GROUP_NOTIFICATION = 1
+REPORT = 2
+
+# Лимиты Telegram: ~30 сообщений/с на бота, 1/с в личный чат, 20/мин в группу.
+# Ёмкость ведра - один токен, поэтому отправки идут равномерно, без всплесков.
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "28"))
+PRIVATE_CHAT_RATE = float(os.getenv("TELEGRAM_PRIVATE_CHAT_RATE", "1"))
+GROUP_CHAT_RATE = float(os.getenv("TELEGRAM_GROUP_CHAT_RATE", str(20 / 60)))
+MAX_RETRIES = 5
+MAX_CONCURRENT_SENDS = 8
+# Как часто удалять вёдра чатов, которые давно ничего не отправляли
+BUCKET_SWEEP_SECONDS = 60
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = monotonic()
+        self.blocked_until = 0.0  # retry_after от Telegram
+
+    def _refill(self, now):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated) * self.rate
+        )
+        self.updated = now
+
+    def delay(self):
+        # Сколько ждать до следующего токена; 0 - токен есть
+        now = monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds):
+        self.blocked_until = max(self.blocked_until, monotonic() + seconds)
+
+    def is_idle(self, now):
+        # Полное ведро без блокировки не отличается от нового - его можно удалить
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class OutboundJob:
+    __slots__ = ("chat_id", "call", "future", "created_at", "attempts")
+
+    def __init__(self, chat_id, call, future):
+        self.chat_id = chat_id
+        self.call = call
+        self.future = future
+        self.created_at = monotonic()
+        self.attempts = 0
+
+
+class OutboundSender:
+    """Единая очередь исходящих сообщений бота.
+
+    Соблюдает глобальный и початовый лимиты Telegram через token bucket,
+    выполняет retry_after при 429 и отправляет ответы пользователям раньше
+    уведомлений в группу, а уведомления - раньше отчётов.
+    """
+
+    def __init__(self):
+        self.bot = None
+        self.queue = asyncio.PriorityQueue()
+        self.sequence = itertools.count()
+        self.global_bucket = TokenBucket(GLOBAL_RATE, 1)
+        self.chat_buckets = {}
+        self.swept_at = monotonic()
+        self.in_flight = set()
+        self.pending = set()  # future каждого ещё не доставленного сообщения
+        self.deferred = 0
+        self.dispatcher_task = None
+        self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_SENDS)
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self, bot):
+        self.bot = bot
+        if self.dispatcher_task is None:
+            self.dispatcher_task = asyncio.create_task(self._dispatch())
+
+    async def stop(self, timeout=30):
+        # Даём доставить уже поставленные в очередь сообщения
+        if self.pending:
+            await asyncio.wait(self.pending, timeout=timeout)
+        if self.dispatcher_task is not None:
+            self.dispatcher_task.cancel()
+            self.dispatcher_task = None
+
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            rate = GROUP_CHAT_RATE if int(chat_id) < 0 else PRIVATE_CHAT_RATE
+            bucket = TokenBucket(rate, 1)
+            self.chat_buckets[chat_id] = bucket
+        return bucket
+
+    def _sweep_chat_buckets(self):
+        # Без очистки словарь рос бы на каждый чат, которому бот когда-то писал
+        now = monotonic()
+        if now - self.swept_at < BUCKET_SWEEP_SECONDS:
+            return
+        self.swept_at = now
+        for chat_id in [
+            chat_id
+            for chat_id, bucket in self.chat_buckets.items()
+            if bucket.is_idle(now)
+        ]:
+            del self.chat_buckets[chat_id]
+
+    def submit(self, chat_id, call, priority=REPORT):
+        # call(bot) -> awaitable с запросом к Bot API
+        if self.dispatcher_task is None:
+            raise RuntimeError("OutboundSender is not started")
+        future = asyncio.get_running_loop().create_future()
+        job = OutboundJob(chat_id, call, future)
+        try:
+            int(chat_id)  # лимит чата выбирается по знаку id
+        except (TypeError, ValueError):
+            # Ошибка только у этого сообщения, очередь не затрагивается
+            self._fail(job, ValueError(f"Invalid chat_id: {chat_id!r}"))
+            return future
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        self._enqueue(priority, job)
+        return future
+
+    def _enqueue(self, priority, job):
+        self.queue.put_nowait((priority, next(self.sequence), job))
+
+    async def send_message(self, chat_id, text, priority=REPORT, **kwargs):
+        return await self.submit(
+            chat_id,
+            lambda bot: bot.send_message(chat_id=chat_id, text=text, **kwargs),
+            priority,
+        )
+
+    async def send_document(self, chat_id, document, priority=REPORT, **kwargs):
+        return await self.submit(
+            chat_id,
+            lambda bot: bot.send_document(chat_id=chat_id, document=document, **kwargs),
+            priority,
+        )
+
+    async def _dispatch(self):
+        while True:
+            priority, sequence, job = await self.queue.get()
+            try:
+                self._sweep_chat_buckets()
+                chat_wait = self._chat_bucket(job.chat_id).delay()
+                if chat_wait > 0:
+                    # Чат упёрся в лимит - откладываем только его, очередь идёт дальше
+                    self._defer(priority, job, chat_wait)
+                    continue
+                global_wait = self.global_bucket.delay()
+                if global_wait > 0:
+                    await asyncio.sleep(global_wait)
+                self.global_bucket.take()
+                self._chat_bucket(job.chat_id).take()
+                await self.semaphore.acquire()
+                task = asyncio.create_task(self._send(priority, job))
+                self.in_flight.add(task)
+                task.add_done_callback(self.in_flight.discard)
+            except Exception as e:
+                # Одно сообщение с ошибкой не должно останавливать очередь
+                self._fail(job, e)
+            finally:
+                self.queue.task_done()
+
+    def _defer(self, priority, job, delay):
+        self.deferred += 1
+        asyncio.get_running_loop().call_later(delay, self._requeue, priority, job)
+
+    def _requeue(self, priority, job):
+        self.deferred -= 1
+        self._enqueue(priority, job)
+
+    async def _send(self, priority, job):
+        # aiogram к этому моменту загружен ботом; импорт на уровне модуля
+        # тянул бы его во все скрипты, которые только импортируют sender
+        from aiogram.exceptions import (TelegramNetworkError,
+                                        TelegramRetryAfter, TelegramServerError)
+
+        try:
+            job.attempts += 1
+            result = await job.call(self.bot)
+        except TelegramRetryAfter as e:
+            self.retried += 1
+            logging.warning(
+                f"Flood wait {e.retry_after}s for chat {job.chat_id}, retrying"
+            )
+            self._chat_bucket(job.chat_id).block(e.retry_after)
+            self._enqueue(priority, job)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            if job.attempts >= MAX_RETRIES:
+                self._fail(job, e)
+            else:
+                self.retried += 1
+                self._defer(priority, job, 2 ** job.attempts)
+        except Exception as e:
+            self._fail(job, e)
+        else:
+            latency = monotonic() - job.created_at
+            self.sent += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+            if not job.future.done():
+                job.future.set_result(result)
+        finally:
+            self.semaphore.release()
+
+    def _fail(self, job, error):
+        self.failed += 1
+        logging.error(f"Failed to send message to {job.chat_id}: {error}")
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue.qsize() + self.deferred,
+            "in_flight": len(self.in_flight),
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "latency_avg": self.latency_total / self.sent if self.sent else 0.0,
+            "latency_max": self.latency_max,
+        }
+
+
+outbound = OutboundSender()
@@ -1,16 +1,16 @@
-import os
+import asyncio
 from datetime import datetime, timedelta
-from sqlalchemy.orm import sessionmaker
-from database import engine, User, Balance, add_user, top_admins
-
-# Create a new session
-Session = sessionmaker(bind=engine)
-session = Session()
+from pytz import utc
+from sqlalchemy import select
+from app import app
+from database import User, add_balance, add_user, top_admins
+from migrations import run_migrations
+from routing import parse_balance
 
 
 # Function to add test users and balances
-def add_test_users_and_balances():
-    yesterday = datetime.now() - timedelta(days=1)
+async def add_test_users_and_balances():
+    yesterday = datetime.now(utc) - timedelta(days=1)
     admins = list(top_admins.keys())
     users_data = [
         {
@@ -23,35 +23,31 @@ def add_test_users_and_balances():
         for i in range(1, 31)
     ]
 
-    for user_data in users_data:
-        add_user(
-            session,
-            telegram_id=user_data["telegram_id"],
-            nickname=user_data["nickname"],
-            admin_nickname=user_data["admin_nickname"],
-            site=user_data["site"],
-            shift=user_data["shift"],
-        )
-        new_balance = Balance(
-            user_id=session.query(User)
-            .filter_by(telegram_id=user_data["telegram_id"])
-            .first()
-            .id,
-            balance=100.0,
-            draft="100.0",
-            timestamp=yesterday.replace(
-                hour=datetime.now().hour,
-                minute=datetime.now().minute,
-                second=0,
-                microsecond=0,
-            ),
-        )
-        session.add(new_balance)
-
-    session.commit()
+    await run_migrations()
+    async with app.session() as session:
+        for user_data in users_data:
+            await add_user(
+                session,
+                telegram_id=user_data["telegram_id"],
+                nickname=user_data["nickname"],
+                admin_nickname=user_data["admin_nickname"],
+                site=user_data["site"],
+                shift=user_data["shift"],
+            )
+            await add_balance(
+                session,
+                user_id=(
+                    await session.scalar(
+                        select(User).filter_by(telegram_id=user_data["telegram_id"])
+                    )
+                ).id,
+                parts=parse_balance("100,00"),
+                draft="100,00",
+                timestamp=yesterday.replace(second=0, microsecond=0),
+            )
+    await app.close()
     print("Test users and balances added successfully.")
 
 
 if __name__ == "__main__":
-    add_test_users_and_balances()
-
+    asyncio.run(add_test_users_and_balances())
@@ -0,0 +1,152 @@
+"""Трассировка SQL на единицу работы: апдейт Telegram или задача планировщика.
+
+Каждый запрос через engine засчитывается текущей трассе (contextvar
+проходит и в greenlet SQLAlchemy). Одинаковые по форме запросы внутри
+одной трассы - вероятный N+1. Медленные и подозрительные трассы пишутся
+одной JSON-строкой в логгер slow_log.
+"""
+import functools
+import json
+import logging
+import os
+import re
+from collections import Counter
+from contextvars import ContextVar
+from time import perf_counter
+
+from aiogram import BaseMiddleware
+from sqlalchemy import event
+
+SLOW_UPDATE_MS = float(os.getenv("TRACE_SLOW_MS", "500"))
+SLOW_JOB_MS = float(os.getenv("TRACE_SLOW_JOB_MS", "5000"))
+MAX_QUERIES = int(os.getenv("TRACE_MAX_QUERIES", "20"))
+# Сколько одинаковых по форме запросов за трассу считаются N+1
+REPEAT_THRESHOLD = int(os.getenv("TRACE_REPEAT_THRESHOLD", "5"))
+
+slow_logger = logging.getLogger("slow_log")
+
+# Списки параметров IN (?, ?, ?) и литералы сворачиваются в одну форму
+_PARAM = r"(?:\?|\$\d+|%\(\w+\)s)"
+_PLACEHOLDERS = re.compile(rf"\(\s*{_PARAM}(?:\s*,\s*{_PARAM})*\s*\)")
+_NUMBERS = re.compile(r"\b\d+\b")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(statement):
+    shape = _PLACEHOLDERS.sub("(?)", statement)
+    shape = _NUMBERS.sub("N", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+class Trace:
+    __slots__ = (
+        "kind",
+        "name",
+        "handler",
+        "details",
+        "started",
+        "queries",
+        "query_seconds",
+        "shapes",
+    )
+
+    def __init__(self, kind, name, **details):
+        self.kind = kind
+        self.name = name
+        self.handler = None  # хендлер апдейта, его уточняет metrics
+        self.details = details
+        self.started = perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.shapes = Counter()
+
+    def repeated(self):
+        return [
+            {"shape": shape, "count": count}
+            for shape, count in self.shapes.most_common()
+            if count >= REPEAT_THRESHOLD
+        ]
+
+    def finish(self, slow_ms):
+        duration_ms = (perf_counter() - self.started) * 1000
+        repeated = self.repeated()
+        reasons = []
+        if duration_ms > slow_ms:
+            reasons.append("slow")
+        if self.queries > MAX_QUERIES:
+            reasons.append("queries")
+        if repeated:
+            reasons.append("n_plus_one")
+        if reasons:
+            entry = {
+                "kind": self.kind,
+                "name": self.name,
+                "handler": self.handler,
+                "reasons": reasons,
+                "duration_ms": round(duration_ms, 1),
+                "queries": self.queries,
+                "query_ms": round(self.query_seconds * 1000, 1),
+                "repeated": repeated,
+                **self.details,
+            }
+            slow_logger.warning(json.dumps(entry, ensure_ascii=False))
+        return reasons
+
+
+_current = ContextVar("query_trace", default=None)
+
+
+def current_trace():
+    return _current.get()
+
+
+def trace_queries(engine):
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        if _current.get() is not None:
+            context.trace_started = perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        trace = _current.get()
+        if trace is None or not hasattr(context, "trace_started"):
+            return
+        trace.queries += 1
+        trace.query_seconds += perf_counter() - context.trace_started
+        trace.shapes[statement_shape(statement)] += 1
+
+
+class QueryTraceMiddleware(BaseMiddleware):
+    """Внешний middleware апдейтов: одна трасса на апдейт."""
+
+    async def __call__(self, handler, update, data):
+        user = data.get("event_from_user")
+        trace = Trace(
+            "update",
+            update.event_type,
+            update_id=update.update_id,
+            user_id=user.id if user else None,
+        )
+        token = _current.set(trace)
+        try:
+            return await handler(update, data)
+        finally:
+            _current.reset(token)
+            trace.finish(SLOW_UPDATE_MS)
+
+
+def traced_job(job):
+    # Обёртка задачи APScheduler: одна трасса на запуск
+    @functools.wraps(job)
+    async def traced():
+        trace = Trace("job", job.__name__)
+        token = _current.set(trace)
+        try:
+            await job()
+        finally:
+            _current.reset(token)
+            trace.finish(SLOW_JOB_MS)
+
+    return traced
@@ -0,0 +1,94 @@
+import os
+from collections import OrderedDict
+from time import monotonic
+
+from sqlalchemy import select
+
+from database import User
+
+
+class CachedUser:
+    """Компактная запись пользователя для хендлеров, без ORM-состояния."""
+
+    __slots__ = (
+        "id",
+        "telegram_id",
+        "nickname",
+        "admin_nickname",
+        "top_admin",
+        "site",
+        "shift",
+    )
+
+    def __init__(self, user):
+        self.id = user.id
+        self.telegram_id = user.telegram_id
+        self.nickname = user.nickname
+        self.admin_nickname = user.admin_nickname
+        self.top_admin = user.top_admin
+        self.site = user.site
+        self.shift = user.shift
+
+
+# Отметка "пользователь не зарегистрирован", чтобы шаги регистрации не ходили в БД
+NOT_REGISTERED = object()
+
+
+class UserCache:
+    """LRU-кэш пользователей по telegram_id с ограничением размера и TTL.
+
+    negative_ttl - сколько помнить, что пользователь не зарегистрирован.
+    С несколькими воркерами это 0: регистрация могла пройти в другом процессе.
+    """
+
+    def __init__(self, maxsize, ttl, negative_ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.entries = OrderedDict()  # telegram_id -> (expires_at, CachedUser)
+
+    def _store(self, telegram_id, value, ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self.entries.pop(telegram_id, None)
+            return
+        self.entries[telegram_id] = (monotonic() + ttl, value)
+        self.entries.move_to_end(telegram_id)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def put(self, user):
+        cached = CachedUser(user)
+        self._store(cached.telegram_id, cached)
+        return cached
+
+    def invalidate(self, telegram_id):
+        self.entries.pop(telegram_id, None)
+
+    async def get_user(self, session, telegram_id):
+        entry = self.entries.get(telegram_id)
+        if entry is not None and entry[0] > monotonic():
+            self.entries.move_to_end(telegram_id)
+            value = entry[1]
+        else:
+            user = await session.scalar(select(User).filter_by(telegram_id=telegram_id))
+            if user:
+                value = CachedUser(user)
+                self._store(telegram_id, value)
+            else:
+                value = NOT_REGISTERED
+                self._store(telegram_id, value, self.negative_ttl)
+        return None if value is NOT_REGISTERED else value
+
+    async def preload(self, session):
+        for user in await session.scalars(select(User).limit(self.maxsize)):
+            self.put(user)
+
+
+user_cache = UserCache(
+    maxsize=int(os.getenv("USER_CACHE_SIZE", "10000")),
+    ttl=int(os.getenv("USER_CACHE_TTL", "3600")),
+    negative_ttl=int(
+        os.getenv("USER_CACHE_NEGATIVE_TTL", os.getenv("USER_CACHE_TTL", "3600"))
+    ),
+)
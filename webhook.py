@@ -0,0 +1,70 @@
+import asyncio
+import os
+import secrets
+
+from aiogram.webhook.aiohttp_server import (SimpleRequestHandler,
+                                            setup_application)
+from aiohttp import web
+
+from metrics import register_gauge
+
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Без WEBHOOK_SECRET секрет генерируется на каждый запуск
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# Сколько апдейтов обрабатывается одновременно, остальные ждут своей очереди
+WEBHOOK_MAX_TASKS = int(os.getenv("WEBHOOK_MAX_TASKS", "32"))
+
+
+class BoundedRequestHandler(SimpleRequestHandler):
+    """Сразу отвечает Telegram 200, а апдейт обрабатывает в фоне.
+
+    Одновременно работают не больше max_tasks апдейтов. Сессию бота при
+    остановке сервера не закрывает - это делает main() после очереди отправки.
+    """
+
+    def __init__(self, dispatcher, bot, max_tasks, secret_token):
+        super().__init__(
+            dispatcher, bot, handle_in_background=True, secret_token=secret_token
+        )
+        self.semaphore = asyncio.Semaphore(max_tasks)
+
+    async def _background_feed_update(self, bot, update):
+        async with self.semaphore:
+            await super()._background_feed_update(bot, update)
+
+    async def close(self):
+        # Дожидаемся уже принятых апдейтов
+        if self._background_feed_update_tasks:
+            await asyncio.wait(self._background_feed_update_tasks)
+
+
+def webhook_url(base_url):
+    return base_url.rstrip("/") + WEBHOOK_PATH
+
+
+async def start_webhook(dispatcher, bot, base_url=None, host=WEBHOOK_HOST,
+                        port=WEBHOOK_PORT, max_tasks=WEBHOOK_MAX_TASKS,
+                        secret_token=WEBHOOK_SECRET, reuse_port=False):
+    # base_url=None - только поднять сервер, не регистрируя вебхук в Telegram.
+    # reuse_port=True - несколько воркеров слушают один порт (SO_REUSEPORT)
+    app = web.Application()
+    handler = BoundedRequestHandler(dispatcher, bot, max_tasks, secret_token)
+    handler.register(app, path=WEBHOOK_PATH)
+    register_gauge(
+        "ratingbot_webhook_updates_in_flight",
+        "Принятые вебхуком апдейты в обработке или в ожидании",
+        lambda: len(handler._background_feed_update_tasks),
+    )
+    setup_application(app, dispatcher, bot=bot)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port, reuse_port=reuse_port).start()
+    if base_url:
+        await bot.set_webhook(
+            webhook_url(base_url),
+            secret_token=secret_token,
+            allowed_updates=dispatcher.resolve_used_update_types(),
+        )
+    return runner
@@ -0,0 +1,118 @@
+"""Режим нескольких воркеров: N процессов принимают один поток апдейтов.
+
+Все воркеры слушают порт вебхука через SO_REUSEPORT, состояние регистрации
+хранится в базе (FSM_STORAGE=sql), а задачи рейтинга выполняет тот воркер,
+который первым записал запуск в job_runs.
+Запуск: python workers.py --count 4 (нужен URL для вебхука)
+"""
+import argparse
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import secrets
+import signal
+import socket
+
+from dotenv import load_dotenv
+from sqlalchemy.exc import IntegrityError
+
+from app import app
+from database import JobRun, get_kyiv_timestamp
+
+load_dotenv()
+
+WORKER_NAME = f"{socket.gethostname()}:{os.getpid()}"
+
+
+async def claim_job_run(job_name):
+    # Первый воркер, вставивший (задача, день), выполняет её; остальные пропускают
+    async with app.session() as session:
+        session.add(
+            JobRun(
+                job_name=job_name,
+                run_day=get_kyiv_timestamp().date(),
+                worker=WORKER_NAME,
+            )
+        )
+        try:
+            await session.commit()
+        except IntegrityError:
+            await session.rollback()
+            return False
+    return True
+
+
+def run_once(job):
+    @functools.wraps(job)
+    async def elected_job():
+        if await claim_job_run(job.__name__):
+            await job()
+        else:
+            logging.info(f"{job.__name__} already ran on another worker")
+
+    return elected_job
+
+
+def run_worker(index):
+    # Своя группа процессов: Ctrl+C получает только родитель и передаёт его один раз
+    os.setpgrp()
+    # Свои файлы логов: ротация из нескольких процессов в один файл небезопасна
+    os.environ["LOG_SUFFIX"] = f"-worker{index}"
+    import main
+
+    asyncio.run(main.main(worker_index=index))
+
+
+async def prepare_database(*steps):
+    # Соединения пула привязаны к циклу событий - закрываем их в том же цикле
+    try:
+        for step in steps:
+            await step()
+    finally:
+        await app.close()
+
+
+def run_workers(count):
+    if not os.getenv("URL"):
+        raise SystemExit("Multi-worker mode needs URL: workers share one webhook")
+    from migrations import run_migrations
+    from retention import ensure_balance_partitions
+    from sender import GLOBAL_RATE, GROUP_CHAT_RATE
+
+    # Настройки наследуют все воркеры: один секрет вебхука, общее FSM-хранилище,
+    # лимиты Telegram делятся между процессами
+    os.environ.setdefault("WEBHOOK_SECRET", secrets.token_urlsafe(32))
+    os.environ.setdefault("FSM_STORAGE", "sql")
+    os.environ.setdefault("USER_CACHE_TTL", "5")
+    os.environ.setdefault("USER_CACHE_NEGATIVE_TTL", "0")
+    os.environ["TELEGRAM_GLOBAL_RATE"] = str(GLOBAL_RATE / count)
+    os.environ["TELEGRAM_GROUP_CHAT_RATE"] = str(GROUP_CHAT_RATE / count)
+    asyncio.run(prepare_database(run_migrations, ensure_balance_partitions))
+
+    # systemd и docker останавливают SIGTERM - обрабатываем его как Ctrl+C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    context = multiprocessing.get_context("spawn")
+    processes = [
+        context.Process(target=run_worker, args=(index,), name=f"worker-{index}")
+        for index in range(count)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Воркеры допишут очереди отправки и выйдут
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+        for process in processes:
+            process.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=os.cpu_count() or 2)
+    run_workers(parser.parse_args().count)